@@ -0,0 +1,32 @@
+"""
+Transkript-Segmente — vektorisierte Nachbearbeitung
+====================================================
+
+Lange Aufnahmen liefern tausende Segment-Dicts. Start-/Endzeiten werden
+einmal in numpy-Arrays überführt, Filter laufen als Array-Masken statt
+als Python-Schleife je Segment.
+"""
+
+import numpy as np
+
+
+def segments_to_arrays(
+    segments: list[dict],
+) -> tuple[np.ndarray, np.ndarray, list[str]]:
+    """Zerlegt Segmente in (starts, ends, texts)."""
+    count = len(segments)
+    starts = np.fromiter((s["start"] for s in segments), dtype=np.float64, count=count)
+    ends = np.fromiter((s["end"] for s in segments), dtype=np.float64, count=count)
+    texts = [s["text"] for s in segments]
+    return starts, ends, texts
+
+
+def segments_text(segments: list[dict], min_duration: float = 0.0) -> str:
+    """
+    Verbindet die Texte aller Segmente, die länger als ``min_duration``
+    Sekunden sind. Segmente ohne Dauer (typische Whisper-Artefakte) fallen
+    damit immer heraus.
+    """
+    starts, ends, texts = segments_to_arrays(segments)
+    keep = np.flatnonzero((ends - starts) > min_duration)
+    return " ".join([texts[i] for i in keep if texts[i]])
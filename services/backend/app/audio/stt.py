@@ -8,33 +8,61 @@ Unterstützt zwei Modi:
 
 Verwendet faster-whisper (CTranslate2) wenn auf ARM verfügbar,
 fällt auf openai-whisper zurück.
+
+Kurze Clips ohne Wort-Zeitstempel werden über einen Micro-Batching-Worker
+gesammelt und gemeinsam durch ``ctranslate2.models.Whisper.generate``
+geschickt, damit gleichzeitige Spracheingaben die Hardware teilen.
 """
 
 import asyncio
 import io
+import os
+import shutil
 import tempfile
-from pathlib import Path
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Optional, Union
 
 import numpy as np
-import soundfile as sf
 from loguru import logger
 
-from app.config import get_settings
+from app.config import cpu_thread_split, get_settings
+
+# Whisper arbeitet intern mit 16 kHz Mono
+WHISPER_SAMPLE_RATE = 16000
+# Maximale Clip-Länge für den Batch-Pfad (ein Whisper-Fenster)
+WHISPER_CHUNK_SECONDS = 30
+# VAD-Parameter (Voll- und Batch-Pfad identisch)
+VAD_PARAMETERS = dict(min_silence_duration_ms=500, speech_pad_ms=200)
+# Stille-Erkennung wie faster-whisper: verwerfen, wenn no_speech_prob hoch
+# und die mittlere Log-Wahrscheinlichkeit niedrig ist (Halluzinationen)
+NO_SPEECH_THRESHOLD = 0.6
+LOG_PROB_THRESHOLD = -1.0
 
 
 class STTService:
     """Whisper-basiertes Speech-to-Text."""
 
-    def __init__(self):
+    def __init__(self, executor: Optional[ThreadPoolExecutor] = None):
+        # Eigener, begrenzter Thread-Pool für Modell-Aufrufe (None → Default-Pool)
+        self._executor = executor
         self._model = None
         self._settings = get_settings()
         self._backend = "unknown"
+        self._batch_queue: asyncio.Queue | None = None
+        self._batch_task: asyncio.Task | None = None
+        self._tokenizers: dict = {}
+        # Begrenzt gleichzeitige Voll-Transkriptionen auf der GPU; der
+        # Micro-Batching-Pfad bündelt ohnehin zu einem generate()-Aufruf
+        self._gpu_slots = asyncio.Semaphore(self._settings.stt_max_concurrency)
 
     async def initialize(self):
         """Whisper-Modell laden (in Thread, da blockierend)."""
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, self._load_model)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._load_model)
+
+        if self._backend == "faster-whisper":
+            self._batch_queue = asyncio.Queue()
+            self._batch_task = asyncio.create_task(self._batch_worker())
 
     def _load_model(self):
         """Versucht faster-whisper, fällt auf openai-whisper zurück."""
@@ -47,20 +75,26 @@ class STTService:
 
             # faster-whisper erwartet Modellnamen wie "large-v3"
             fw_model_name = model_name.replace("openai/whisper-", "")
-            compute_type = "float16" if device == "cuda" else "int8"
+            # "auto" → CTranslate2 wählt den schnellsten Kernel für die Hardware
+            compute_type = self._settings.stt_compute_type
+            cpu_threads = cpu_thread_split()[1]
 
             logger.info(
                 f"Lade faster-whisper: {fw_model_name} "
-                f"({device}, {compute_type})"
+                f"({device}, {compute_type}, {cpu_threads} Threads)"
             )
             self._model = WhisperModel(
                 fw_model_name,
                 device=device,
                 compute_type=compute_type,
-                cpu_threads=4,
+                cpu_threads=cpu_threads,
+                num_workers=self._settings.stt_num_workers,
             )
             self._backend = "faster-whisper"
-            logger.info("faster-whisper erfolgreich geladen.")
+            logger.info(
+                f"faster-whisper erfolgreich geladen "
+                f"(effektiver compute_type: {self._model.model.compute_type})."
+            )
             return
 
         except Exception as e:
@@ -89,18 +123,55 @@ class STTService:
         return self._model is not None
 
     async def shutdown(self):
-        """Modell freigeben."""
+        """Modell freigeben (inkl. CTranslate2-/CUDA-Speicher)."""
+        if self._batch_task is not None:
+            self._batch_task.cancel()
+            self._batch_task = None
+
+        if self._model is not None and self._backend == "faster-whisper":
+            try:
+                self._model.model.unload_model(to_cpu=False)
+            except AttributeError:
+                pass
+
         self._model = None
+        self._tokenizers.clear()
+
+        if self._backend == "openai-whisper":
+            self._release_cuda_memory()
+
         logger.info("STT-Service heruntergefahren.")
 
+    def _release_cuda_memory(self):
+        """Gibt gecachten PyTorch-CUDA-Speicher frei (openai-whisper)."""
+        try:
+            import torch
+        except ImportError:
+            return
+        if not torch.cuda.is_available():
+            return
+
+        torch.cuda.empty_cache()
+        torch.cuda.ipc_collect()
+        free, total = torch.cuda.mem_get_info()
+        logger.info(
+            f"CUDA-Speicher nach STT-Shutdown: "
+            f"{free / 1024**3:.1f} / {total / 1024**3:.1f} GB frei"
+        )
+
     async def transcribe(
         self,
-        audio_bytes: bytes,
+        audio: Union[bytes, BinaryIO],
         language: str = "de",
         word_timestamps: bool = False,
     ) -> dict:
         """
-        Transkribiert Audio-Bytes zu Text.
+        Transkribiert Audio zu Text.
+
+        Args:
+            audio: Audio-Bytes oder ein lesbares Dateiobjekt (z.B. der
+                bereits gespoolte ``UploadFile.file``), das nicht erst
+                vollständig in den Speicher kopiert werden muss.
 
         Returns:
             dict mit 'text', 'language', 'duration', 'segments'
@@ -108,67 +179,244 @@ class STTService:
         if self._model is None:
             raise RuntimeError("STT-Modell nicht initialisiert.")
 
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(
-            None,
-            lambda: self._transcribe_sync(audio_bytes, language, word_timestamps),
+        loop = asyncio.get_running_loop()
+
+        if self._batch_queue is not None and not word_timestamps:
+            samples = await loop.run_in_executor(
+                self._executor, self._decode_audio, audio
+            )
+            if len(samples) <= WHISPER_CHUNK_SECONDS * WHISPER_SAMPLE_RATE:
+                return await self._transcribe_batched(samples, language)
+            async with self._gpu_slots:
+                return await loop.run_in_executor(
+                    self._executor,
+                    self._transcribe_faster_whisper,
+                    samples,
+                    language,
+                    False,
+                )
+
+        async with self._gpu_slots:
+            return await loop.run_in_executor(
+                self._executor,
+                self._transcribe_sync,
+                audio,
+                language,
+                word_timestamps,
+            )
+
+    # ------------------------------------------------------------------
+    # Micro-Batching (nur faster-whisper)
+    # ------------------------------------------------------------------
+    async def _transcribe_batched(self, audio: np.ndarray, language: str) -> dict:
+        """Reiht einen kurzen Clip in den Batch-Worker ein und wartet auf das Ergebnis."""
+        loop = asyncio.get_running_loop()
+        duration = len(audio) / WHISPER_SAMPLE_RATE
+        features = await loop.run_in_executor(
+            self._executor, self._extract_features, audio
+        )
+
+        text = ""
+        if features is not None:
+            tokenizer = self._get_tokenizer(language)
+            prompt = list(tokenizer.sot_sequence) + [tokenizer.no_timestamps]
+
+            future = loop.create_future()
+            await self._batch_queue.put((features, prompt, tokenizer, future))
+            text = await future
+
+        return {
+            "text": text,
+            "language": language,
+            "duration": duration,
+            "segments": [{"start": 0.0, "end": duration, "text": text}] if text else [],
+        }
+
+    def _extract_features(self, audio: np.ndarray) -> Optional[np.ndarray]:
+        """
+        VAD wie im Voll-Pfad (nur Sprachanteile), dann Mel-Features auf ein
+        volles Whisper-Fenster gepaddet (außerhalb des Batches).
+        None, wenn der Clip keine Sprache enthält.
+        """
+        from faster_whisper.audio import pad_or_trim
+        from faster_whisper.vad import VadOptions, get_speech_timestamps
+
+        speech = get_speech_timestamps(audio, VadOptions(**VAD_PARAMETERS))
+        if not speech:
+            return None
+        audio = np.concatenate([audio[c["start"]:c["end"]] for c in speech])
+
+        features = self._model.feature_extractor(audio)
+        return pad_or_trim(features)
+
+    def _get_tokenizer(self, language: str):
+        """Tokenizer je Sprache (gecached)."""
+        tokenizer = self._tokenizers.get(language)
+        if tokenizer is None:
+            from faster_whisper.tokenizer import Tokenizer
+
+            tokenizer = Tokenizer(
+                self._model.hf_tokenizer,
+                self._model.model.is_multilingual,
+                task="transcribe",
+                language=language,
+            )
+            self._tokenizers[language] = tokenizer
+        return tokenizer
+
+    async def _batch_worker(self):
+        """Sammelt Anfragen im Zeitfenster und dekodiert sie gemeinsam."""
+        loop = asyncio.get_running_loop()
+        max_size = self._settings.stt_batch_max_size
+        window = self._settings.stt_batch_window_ms / 1000
+
+        while True:
+            batch = [await self._batch_queue.get()]
+            deadline = loop.time() + window
+            while len(batch) < max_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(
+                        await asyncio.wait_for(self._batch_queue.get(), remaining)
+                    )
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                texts = await loop.run_in_executor(
+                    self._executor, self._generate_batch, batch
+                )
+            except Exception as e:
+                logger.error(f"STT-Batch fehlgeschlagen: {e}")
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (*_, future), text in zip(batch, texts):
+                if not future.done():
+                    future.set_result(text)
+
+    def _generate_batch(self, batch: list) -> list[str]:
+        """Ein einziger CTranslate2-``generate``-Aufruf für alle Clips im Batch."""
+        import ctranslate2
+
+        features = ctranslate2.StorageView.from_array(
+            np.ascontiguousarray(np.stack([item[0] for item in batch]))
         )
-        return result
+        prompts = [item[1] for item in batch]
+        results = self._model.model.generate(
+            features,
+            prompts,
+            beam_size=5,
+            return_scores=True,
+            return_no_speech_prob=True,
+        )
+
+        return [
+            ""
+            if self._is_silence(result)
+            else tokenizer.decode(result.sequences_ids[0]).strip()
+            for (_, _, tokenizer, _), result in zip(batch, results)
+        ]
+
+    @staticmethod
+    def _is_silence(result) -> bool:
+        """Stille-Heuristik von faster-whisper auf ein generate()-Ergebnis."""
+        if result.no_speech_prob <= NO_SPEECH_THRESHOLD:
+            return False
+        # scores = kumulierte Log-Wahrscheinlichkeit / Länge (length_penalty=1)
+        seq_len = len(result.sequences_ids[0])
+        avg_logprob = result.scores[0] * seq_len / (seq_len + 1)
+        return avg_logprob < LOG_PROB_THRESHOLD
 
     def _transcribe_sync(
         self,
-        audio_bytes: bytes,
+        source: Union[bytes, BinaryIO],
         language: str,
         word_timestamps: bool,
     ) -> dict:
         """Synchrone Transkription (wird in Thread ausgeführt)."""
+        audio = self._decode_audio(source)
 
-        # Audio-Bytes in temporäre Datei schreiben
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=True) as tmp:
-            tmp.write(audio_bytes)
-            tmp.flush()
-            tmp_path = tmp.name
+        if self._backend == "faster-whisper":
+            return self._transcribe_faster_whisper(audio, language, word_timestamps)
+        else:
+            return self._transcribe_openai_whisper(audio, language, word_timestamps)
 
-            if self._backend == "faster-whisper":
-                return self._transcribe_faster_whisper(
-                    tmp_path, language, word_timestamps
-                )
-            else:
-                return self._transcribe_openai_whisper(
-                    tmp_path, language, word_timestamps
-                )
+    def _decode_audio(self, source: Union[bytes, BinaryIO]) -> np.ndarray:
+        """
+        Dekodiert Audio (Bytes oder Dateiobjekt) zu float32 Mono @ 16 kHz.
+        Kein Umweg über zusätzliche temporäre Dateien.
+        """
+        import soundfile as sf
+
+        stream = io.BytesIO(source) if isinstance(source, bytes) else source
+        stream.seek(0)
+        try:
+            data, sr = sf.read(stream, dtype="float32", always_2d=False)
+        except sf.LibsndfileError:
+            # Container, die libsndfile nicht kennt (z.B. WebM/Opus aus dem Browser)
+            stream.seek(0)
+            if self._backend != "faster-whisper":
+                return self._decode_with_ffmpeg(stream)
+            from faster_whisper.audio import decode_audio
+
+            return decode_audio(stream, sampling_rate=WHISPER_SAMPLE_RATE)
+
+        if data.ndim == 2:
+            data = data.mean(axis=1)
+
+        if sr != WHISPER_SAMPLE_RATE:
+            import librosa
+
+            data = librosa.resample(data, orig_sr=sr, target_sr=WHISPER_SAMPLE_RATE)
+
+        return np.ascontiguousarray(data, dtype=np.float32)
+
+    @staticmethod
+    def _decode_with_ffmpeg(stream: BinaryIO) -> np.ndarray:
+        """openai-whisper: Dekodierung über ffmpeg, das einen Dateipfad braucht."""
+        import whisper
+
+        with tempfile.NamedTemporaryFile(delete=False) as tmp:
+            shutil.copyfileobj(stream, tmp, 1 << 20)
+            tmp_path = tmp.name
+        try:
+            return whisper.audio.load_audio(tmp_path, sr=WHISPER_SAMPLE_RATE)
+        finally:
+            os.unlink(tmp_path)
 
     def _transcribe_faster_whisper(
-        self, audio_path: str, language: str, word_timestamps: bool
+        self, audio: np.ndarray, language: str, word_timestamps: bool
     ) -> dict:
         """Transkription mit faster-whisper."""
         segments_iter, info = self._model.transcribe(
-            audio_path,
+            audio,
             language=language,
             beam_size=5,
             word_timestamps=word_timestamps,
             vad_filter=True,
-            vad_parameters=dict(
-                min_silence_duration_ms=500,
-                speech_pad_ms=200,
-            ),
+            vad_parameters=VAD_PARAMETERS,
         )
 
         segments = []
         full_text_parts = []
         for segment in segments_iter:
             seg_data = {
-                "start": round(segment.start, 2),
-                "end": round(segment.end, 2),
+                "start": segment.start,
+                "end": segment.end,
                 "text": segment.text.strip(),
             }
             if word_timestamps and segment.words:
                 seg_data["words"] = [
                     {
                         "word": w.word,
-                        "start": round(w.start, 2),
-                        "end": round(w.end, 2),
-                        "probability": round(w.probability, 3),
+                        "start": w.start,
+                        "end": w.end,
+                        "probability": w.probability,
                     }
                     for w in segment.words
                 ]
@@ -178,16 +426,16 @@ class STTService:
         return {
             "text": " ".join(full_text_parts),
             "language": info.language,
-            "duration": round(info.duration, 2),
+            "duration": info.duration,
             "segments": segments,
         }
 
     def _transcribe_openai_whisper(
-        self, audio_path: str, language: str, word_timestamps: bool
+        self, audio: np.ndarray, language: str, word_timestamps: bool
     ) -> dict:
         """Transkription mit openai-whisper."""
         result = self._model.transcribe(
-            audio_path,
+            audio,
             language=language,
             word_timestamps=word_timestamps,
             verbose=False,
@@ -196,17 +444,17 @@ class STTService:
         segments = []
         for seg in result.get("segments", []):
             seg_data = {
-                "start": round(seg["start"], 2),
-                "end": round(seg["end"], 2),
+                "start": seg["start"],
+                "end": seg["end"],
                 "text": seg["text"].strip(),
             }
             if word_timestamps and "words" in seg:
                 seg_data["words"] = [
                     {
                         "word": w["word"],
-                        "start": round(w["start"], 2),
-                        "end": round(w["end"], 2),
-                        "probability": round(w.get("probability", 0), 3),
+                        "start": w["start"],
+                        "end": w["end"],
+                        "probability": w.get("probability", 0),
                     }
                     for w in seg["words"]
                 ]
@@ -217,6 +465,6 @@ class STTService:
         return {
             "text": result["text"].strip(),
             "language": result.get("language", language),
-            "duration": round(duration, 2),
+            "duration": duration,
             "segments": segments,
         }
@@ -3,6 +3,8 @@ Psychiatrische KI-Plattform — Zentrale Konfiguration
 Alle Einstellungen werden aus Umgebungsvariablen geladen.
 """
 
+import os
+
 from pydantic_settings import BaseSettings
 from pydantic import Field
 from functools import lru_cache
@@ -21,6 +23,12 @@ class Settings(BaseSettings):
     stt_model: str = Field("openai/whisper-large-v3", alias="STT_MODEL")
     stt_language: str = Field("de", alias="STT_LANGUAGE")
     stt_device: str = Field("cuda", alias="STT_DEVICE")
+    stt_compute_type: str = Field("auto", alias="STT_COMPUTE_TYPE")
+    stt_num_workers: int = Field(2, alias="STT_NUM_WORKERS")
+    stt_max_concurrency: int = Field(1, alias="STT_MAX_CONCURRENCY")
+    stt_min_segment_duration: float = Field(0.0, alias="STT_MIN_SEGMENT_DURATION")
+    stt_batch_max_size: int = Field(8, alias="STT_BATCH_MAX_SIZE")
+    stt_batch_window_ms: int = Field(10, alias="STT_BATCH_WINDOW_MS")
 
     # --- TTS ---
     tts_service_url: str = Field("http://tts:8001", alias="TTS_SERVICE_URL")
@@ -37,10 +45,20 @@ class Settings(BaseSettings):
     )
     embedding_device: str = Field("cpu", alias="EMBEDDING_DEVICE")
     embedding_batch_size: int = Field(32, alias="EMBEDDING_BATCH_SIZE")
+    embedding_onnx: bool = Field(True, alias="EMBEDDING_ONNX")
+    embedding_onnx_dir: str = Field(
+        "/data/models/embedding-onnx", alias="EMBEDDING_ONNX_DIR"
+    )
+    embedding_max_length: int = Field(512, alias="EMBEDDING_MAX_LENGTH")
+    embedding_query_cache_size: int = Field(1024, alias="EMBEDDING_QUERY_CACHE_SIZE")
+    embedding_query_cache_ttl: float = Field(900.0, alias="EMBEDDING_QUERY_CACHE_TTL")
+    embedding_num_workers: int = Field(2, alias="EMBEDDING_NUM_WORKERS")
 
     # --- Qdrant ---
     qdrant_host: str = Field("qdrant", alias="QDRANT_HOST")
     qdrant_port: int = Field(6333, alias="QDRANT_PORT")
+    qdrant_grpc_port: int = Field(6334, alias="QDRANT_GRPC_PORT")
+    qdrant_prefer_grpc: bool = Field(True, alias="QDRANT_PREFER_GRPC")
     qdrant_collection: str = Field(
         "psychiatric_knowledge", alias="QDRANT_COLLECTION"
     )
@@ -50,6 +68,9 @@ class Settings(BaseSettings):
     rag_chunk_overlap: int = Field(64, alias="RAG_CHUNK_OVERLAP")
     rag_top_k: int = Field(5, alias="RAG_TOP_K")
     rag_similarity_threshold: float = Field(0.7, alias="RAG_SIMILARITY_THRESHOLD")
+    rag_hnsw_ef: int = Field(128, alias="RAG_HNSW_EF")
+    rag_oversampling: float = Field(2.0, alias="RAG_OVERSAMPLING")
+    rag_recent_queries: int = Field(4, alias="RAG_RECENT_QUERIES")
 
     # --- Server ---
     backend_host: str = Field("0.0.0.0", alias="BACKEND_HOST")
@@ -65,3 +86,16 @@ class Settings(BaseSettings):
 def get_settings() -> Settings:
     """Singleton für Settings — cached nach erstem Aufruf."""
     return Settings()
+
+
+def cpu_thread_split() -> tuple[int, int]:
+    """
+    Teilt die CPU-Kerne zwischen Embedding (torch/ONNX Runtime) und
+    STT (CTranslate2) auf, damit sich beide nicht gegenseitig verdrängen.
+
+    Returns:
+        (embedding_threads, stt_threads)
+    """
+    n = os.cpu_count() or 2
+    embedding_threads = max(1, n // 2)
+    return embedding_threads, max(1, n - embedding_threads)
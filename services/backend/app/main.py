@@ -13,21 +13,49 @@ Orchestriert alle Services:
 Exponiert OpenAI-kompatible API für Open WebUI.
 """
 
+import asyncio
+import os
 import uuid
 import time
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from types import SimpleNamespace
 
+from app.config import cpu_thread_split, get_settings
+
+# ---------------------------------------------------------------------------
+# Thread-Pools begrenzen — muss vor dem Import von numpy/torch passieren,
+# da OpenMP/MKL/OpenBLAS die Variablen nur beim Laden lesen.
+# Hälfte der Kerne für Embedding, Rest für CTranslate2 (Whisper).
+# ---------------------------------------------------------------------------
+_EMBEDDING_THREADS, _STT_THREADS = cpu_thread_split()
+for _var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+    os.environ.setdefault(_var, str(_EMBEDDING_THREADS))
+
+import httpx
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from loguru import logger
 
-from app.config import get_settings
 from app.routes import chat, audio, documents, rag, health
 from app.rag.embedding import EmbeddingService
 from app.rag.vectorstore import VectorStoreService
 from app.audio.stt import STTService
 
 
+# ---------------------------------------------------------------------------
+# Zeitstempel für /health — einmal pro Sekunde statt pro Probe erzeugen
+# ---------------------------------------------------------------------------
+async def _update_timestamp(application: FastAPI):
+    while True:
+        application.state.now_iso = datetime.now(timezone.utc).isoformat(
+            timespec="seconds"
+        )
+        await asyncio.sleep(1)
+
+
 # ---------------------------------------------------------------------------
 # Lifespan — Initialisierung und Shutdown
 # ---------------------------------------------------------------------------
@@ -39,10 +67,59 @@ async def lifespan(application: FastAPI):
     logger.info(f"LLM: {settings.llm_model} via {settings.llm_base_url}")
     logger.info(f"Embedding: {settings.embedding_model} auf {settings.embedding_device}")
     logger.info(f"Qdrant: {settings.qdrant_host}:{settings.qdrant_port}")
+    logger.info(
+        f"CPU-Threads: Embedding {_EMBEDDING_THREADS}, STT {_STT_THREADS}"
+    )
+
+    # torch-Threads vor dem Laden der Modelle festlegen (kein Oversubscribing)
+    try:
+        import torch
+
+        torch.set_num_threads(_EMBEDDING_THREADS)
+        torch.set_num_interop_threads(1)
+    except ImportError:
+        pass
+
+    # Gemeinsamer HTTP-Client (Connection-Pooling für vLLM, TTS, OCR, Denoiser)
+    application.state.http = httpx.AsyncClient(
+        http2=True,
+        timeout=httpx.Timeout(connect=5, read=600, write=600, pool=5),
+        limits=httpx.Limits(max_connections=200, max_keepalive_connections=100),
+    )
+
+    # Upstream-Endpunkte einmalig parsen (statt f-String + URL-Parsing je Anfrage)
+    application.state.urls = SimpleNamespace(
+        llm_chat=httpx.URL(f"{settings.llm_base_url}/chat/completions"),
+        tts=httpx.URL(f"{settings.tts_service_url}/synthesize"),
+        denoise=httpx.URL(f"{settings.denoiser_service_url}/denoise"),
+        ocr=httpx.URL(f"{settings.ocr_service_url}/process"),
+    )
+
+    # /v1/models-Antwort einmalig aufbauen (Modell ändert sich zur Laufzeit nicht)
+    application.state.models_payload = {
+        "object": "list",
+        "data": [
+            {
+                "id": settings.llm_model.rsplit("/", 1)[-1],
+                "object": "model",
+                "created": int(time.time()),
+                "owned_by": "local",
+                "permission": [],
+            }
+        ],
+    }
+
+    # Begrenzte Thread-Pools für Modell-Aufrufe (statt Default-Executor)
+    application.state.embedding_executor = ThreadPoolExecutor(
+        max_workers=settings.embedding_num_workers, thread_name_prefix="embedding"
+    )
+    application.state.stt_executor = ThreadPoolExecutor(
+        max_workers=settings.stt_num_workers, thread_name_prefix="stt"
+    )
 
     # Embedding-Modell laden (CPU — blockiert GPU nicht)
     logger.info("Lade Embedding-Modell...")
-    embedding_svc = EmbeddingService()
+    embedding_svc = EmbeddingService(application.state.embedding_executor)
     await embedding_svc.initialize()
     application.state.embedding = embedding_svc
     logger.info("Embedding-Modell geladen.")
@@ -56,19 +133,25 @@ async def lifespan(application: FastAPI):
 
     # STT (Whisper) laden
     logger.info("Lade Whisper STT-Modell...")
-    stt_svc = STTService()
+    stt_svc = STTService(application.state.stt_executor)
     await stt_svc.initialize()
     application.state.stt = stt_svc
     logger.info("Whisper STT bereit.")
 
+    timestamp_task = asyncio.create_task(_update_timestamp(application))
+
     logger.info("=== Alle Services bereit ===")
 
     yield
 
     # Shutdown
     logger.info("=== Shutdown ===")
+    timestamp_task.cancel()
     if hasattr(application.state, "stt"):
         await application.state.stt.shutdown()
+    await application.state.http.aclose()
+    application.state.stt_executor.shutdown(wait=False, cancel_futures=True)
+    application.state.embedding_executor.shutdown(wait=False, cancel_futures=True)
     logger.info("Shutdown abgeschlossen.")
 
 
@@ -80,6 +163,7 @@ app = FastAPI(
     description="Lokale KI-Plattform für psychiatrische Diagnostik und Dokumentation",
     version="1.0.0",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 # CORS für Open WebUI
@@ -6,8 +6,14 @@ Zerlegt Dokumente in überlappende Chunks für die Vektorisierung.
 Optimiert für psychiatrische Fachtexte und Gerichtsakten.
 """
 
+import bisect
+import re
+
 from app.config import get_settings
 
+# Chunks unterhalb dieser Länge werden verworfen
+MIN_CHUNK_LENGTH = 50
+
 
 class TextChunker:
     """Teilt Text in überlappende Chunks mit konfigurierbarer Größe."""
@@ -37,6 +43,8 @@ class TextChunker:
         1. Versuche an natürlichen Grenzen (Absätze, Sätze) zu trennen
         2. Überlappung für Kontexterhalt zwischen Chunks
         3. Kein Chunk kürzer als 50 Zeichen (Mindestlänge)
+        4. Jeder Schritt rückt bis hinter die Überlappung vor (keine
+           Endlosschleife, keine Beinahe-Duplikate)
         """
         if not text or not text.strip():
             return []
@@ -47,6 +55,13 @@ class TextChunker:
         if len(text) <= self._chunk_size:
             return [text]
 
+        # Positionen aller Trennzeichen einmalig vorberechnen (inkl. überlappender
+        # Vorkommen, wie rfind sie finden würde) → Binärsuche statt rfind je Chunk
+        offsets = [
+            (sep, [m.start() for m in re.finditer(f"(?={re.escape(sep)})", text)])
+            for sep in self._separators
+        ]
+
         chunks = []
         start = 0
 
@@ -56,27 +71,34 @@ class TextChunker:
 
             if end >= len(text):
                 # Letzter Chunk
-                chunk = text[start:].strip()
-                if chunk and len(chunk) >= 50:
-                    chunks.append(chunk)
+                if len(text) - start >= MIN_CHUNK_LENGTH:
+                    chunk = text[start:].strip()
+                    if len(chunk) >= MIN_CHUNK_LENGTH:
+                        chunks.append(chunk)
                 break
 
-            # Natürliche Trennstelle finden (rückwärts suchen)
+            # Natürliche Trennstelle finden (letztes Vorkommen, das vor end
+            # endet). Nur Trennstellen hinter der Überlappung zählen, sonst
+            # besteht der Chunk nur aus dem Ende des vorherigen.
             best_split = end
-            for sep in self._separators:
-                # Suche rückwärts ab end-Position
-                split_pos = text.rfind(sep, start, end)
-                if split_pos > start:
-                    best_split = split_pos + len(sep)
+            min_split = start + self._overlap
+            for sep, positions in offsets:
+                idx = bisect.bisect_right(positions, end - len(sep)) - 1
+                if idx >= 0 and positions[idx] + len(sep) > min_split:
+                    best_split = positions[idx] + len(sep)
                     break
 
-            chunk = text[start:best_split].strip()
-            if chunk and len(chunk) >= 50:
-                chunks.append(chunk)
+            # Zu kurze Rohabschnitte gar nicht erst strippen
+            if best_split - start >= MIN_CHUNK_LENGTH:
+                chunk = text[start:best_split].strip()
+                if len(chunk) >= MIN_CHUNK_LENGTH:
+                    chunks.append(chunk)
 
-            # Nächster Chunk-Start mit Überlappung
-            start = best_split - self._overlap
-            if start < 0:
-                start = 0
+            # Nächster Chunk-Start mit Überlappung; falls die Überlappung nicht
+            # kleiner als der Chunk ist, ohne Überlappung weiter (immer vorwärts)
+            if best_split - self._overlap > start:
+                start = best_split - self._overlap
+            else:
+                start = best_split
 
         return chunks
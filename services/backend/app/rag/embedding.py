@@ -4,33 +4,245 @@ Embedding-Service — multilingual-e5-large
 
 Läuft auf CPU (Grace ARM), um GPU-Speicher für das LLM freizuhalten.
 Unterstützt Batch-Embedding für effiziente Dokumenten-Indexierung.
+
+Bevorzugter Pfad: INT8-quantisierter ONNX-Encoder (ONNX Runtime), einmalig
+exportiert und im Cache-Verzeichnis abgelegt. Fallback: SentenceTransformer
+(FP32), wenn ONNX Runtime fehlt oder die CPU keine INT8-Dot-Product-
+Instruktionen (VNNI / ARM dotprod) hat.
 """
 
 import asyncio
-from typing import Union
+import platform
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional, Union
 
-import torch
+import numpy as np
 from loguru import logger
-from sentence_transformers import SentenceTransformer
 
-from app.config import get_settings
+from app.config import cpu_thread_split, get_settings
+from app.utils.hash import fast_digest
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+# CPU-Flags für schnelle INT8-Skalarprodukte (x86 VNNI, ARM dotprod/i8mm)
+_INT8_DOT_FLAGS = {"avx512_vnni", "avx_vnni", "asimddp", "i8mm"}
+
+# E5-Präfixe für Suchanfragen bzw. Dokument-Chunks
+QUERY_PREFIX = "query: "
+PASSAGE_PREFIX = "passage: "
+
+_ONNX_MODEL_FILE = "model-int8.onnx"
+_ONNX_OPTIMIZED_FILE = "model-int8.opt.onnx"
+
+
+def _mean_pool_normalize(hidden: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """Mean-Pooling über maskierte Tokens + L2-Normalisierung (numpy)."""
+    mask = mask[..., None].astype(np.float32)
+    pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+    pooled /= np.linalg.norm(pooled, axis=1, keepdims=True)
+    return pooled
+
+
+def _compile_fused_pool():
+    """
+    Kompiliert Pooling + Normalisierung als einen numba-Kernel, der jede
+    (L, D)-Zeile nur einmal liest. Gibt None zurück, wenn numba fehlt.
+    """
+    try:
+        from numba import njit, prange
+    except ImportError:
+        return None
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def pool_and_normalize(hidden, mask, out):
+        batch, seq_len, dim = hidden.shape
+        for b in prange(batch):
+            acc = out[b]
+            acc[:] = 0.0
+            for t in range(seq_len):
+                if mask[b, t]:
+                    for d in range(dim):
+                        acc[d] += hidden[b, t, d]
+            # Summe statt Mittelwert: Richtung identisch, Division entfällt
+            sumsq = 0.0
+            for d in range(dim):
+                sumsq += acc[d] * acc[d]
+            inv_norm = 1.0 / max(np.sqrt(sumsq), 1e-12)
+            for d in range(dim):
+                acc[d] *= inv_norm
+
+    def fused(hidden: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        out = np.empty((hidden.shape[0], hidden.shape[2]), dtype=np.float32)
+        pool_and_normalize(hidden, mask, out)
+        return out
+
+    return fused
+
+
+def _cpu_supports_int8_dot() -> bool:
+    """Prüft /proc/cpuinfo auf INT8-Dot-Product-Unterstützung."""
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key.strip() in ("flags", "Features"):
+                    return bool(_INT8_DOT_FLAGS & set(value.split()))
+    except OSError:
+        pass
+    return False
 
 
 class EmbeddingService:
     """Verwaltet das Embedding-Modell (multilingual-e5-large)."""
 
-    def __init__(self):
-        self._model: SentenceTransformer | None = None
+    def __init__(self, executor: Optional[ThreadPoolExecutor] = None):
+        # Eigener, begrenzter Thread-Pool für Modell-Aufrufe (None → Default-Pool)
+        self._executor = executor
+        self._model: "SentenceTransformer | None" = None
+        self._session = None  # onnxruntime.InferenceSession
+        self._tokenizer = None
+        self._onnx_inputs: set[str] = set()
+        # Vorab tokenisierte Präfixe (nur ONNX-Pfad)
+        self._prefix_ids: dict[str, list[int]] = {}
+        self._pool = _mean_pool_normalize
         self._settings = get_settings()
+        # LRU-Cache mit TTL für Query-Embeddings
+        # (Key: BLAKE2b-Hash der normalisierten Anfrage, Wert: (Zeitstempel, Embedding))
+        self._query_cache: OrderedDict[bytes, tuple[float, np.ndarray]] = OrderedDict()
         self._dimension: int = 1024  # multilingual-e5-large Output-Dimension
 
     async def initialize(self):
         """Modell laden (blockierend → in Thread ausführen)."""
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, self._load_model)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._load_model)
 
     def _load_model(self):
-        """Lädt das Embedding-Modell."""
+        """Lädt das Embedding-Modell (ONNX INT8 bevorzugt)."""
+        use_onnx = (
+            self._settings.embedding_onnx and self._settings.embedding_device == "cpu"
+        )
+        if use_onnx and self._load_onnx_model():
+            return
+        self._load_sentence_transformer()
+
+    def _load_onnx_model(self) -> bool:
+        """
+        Lädt den INT8-ONNX-Encoder. Exportiert und quantisiert ihn beim
+        ersten Start. Gibt False zurück, wenn auf SentenceTransformer
+        zurückgefallen werden soll.
+        """
+        try:
+            import onnxruntime as ort
+            from transformers import AutoTokenizer
+        except ImportError as e:
+            logger.warning(f"ONNX Runtime nicht verfügbar, nutze SentenceTransformer: {e}")
+            return False
+
+        if not _cpu_supports_int8_dot():
+            logger.warning(
+                "CPU ohne INT8-Dot-Product (VNNI/dotprod) — "
+                "nutze SentenceTransformer (FP32)."
+            )
+            return False
+
+        model_name = self._settings.embedding_model
+        onnx_path = Path(self._settings.embedding_onnx_dir) / _ONNX_MODEL_FILE
+        optimized_path = onnx_path.with_name(_ONNX_OPTIMIZED_FILE)
+
+        try:
+            if not onnx_path.exists():
+                self._export_onnx_model(model_name, onnx_path)
+
+            sess_options = ort.SessionOptions()
+            sess_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+            sess_options.enable_cpu_mem_arena = True
+            sess_options.intra_op_num_threads = cpu_thread_split()[0]
+            sess_options.inter_op_num_threads = 1
+            sess_options.add_session_config_entry("session.intra_op.allow_spinning", "1")
+
+            if optimized_path.exists():
+                # Graph-Fusionen wurden bereits beim ersten Start angewendet
+                model_path = optimized_path
+                sess_options.graph_optimization_level = (
+                    ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+                )
+            else:
+                model_path = onnx_path
+                sess_options.graph_optimization_level = (
+                    ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+                )
+                sess_options.optimized_model_filepath = str(optimized_path)
+
+            providers = ["CPUExecutionProvider"]
+            if (
+                platform.machine() in ("aarch64", "arm64")
+                and "XnnpackExecutionProvider" in ort.get_available_providers()
+            ):
+                providers.insert(0, "XnnpackExecutionProvider")
+
+            self._session = ort.InferenceSession(
+                str(model_path),
+                sess_options=sess_options,
+                providers=providers,
+            )
+            self._tokenizer = AutoTokenizer.from_pretrained(model_name)
+        except Exception as e:
+            logger.warning(f"ONNX-Encoder nicht ladbar, nutze SentenceTransformer: {e}")
+            self._session = None
+            return False
+
+        self._onnx_inputs = {i.name for i in self._session.get_inputs()}
+        self._prefix_ids = {
+            prefix: self._tokenizer(prefix.rstrip(), add_special_tokens=False)["input_ids"]
+            for prefix in ("", QUERY_PREFIX, PASSAGE_PREFIX)
+        }
+        output_dim = self._session.get_outputs()[0].shape[-1]
+        if isinstance(output_dim, int):
+            self._dimension = output_dim
+
+        fused_pool = _compile_fused_pool()
+        if fused_pool is not None:
+            # numba kompiliert erst beim ersten Aufruf → jetzt, mit den dtypes
+            # aus encode (float32-Hidden-States, int64-Maske), nicht im ersten Request
+            fused_pool(
+                np.zeros((1, 1, self._dimension), dtype=np.float32),
+                np.ones((1, 1), dtype=np.int64),
+            )
+            self._pool = fused_pool
+
+        logger.info(
+            f"Embedding-Modell geladen (ONNX INT8): {model_path}, "
+            f"Dimension: {self._dimension}, "
+            f"Provider: {self._session.get_providers()}"
+        )
+        return True
+
+    def _export_onnx_model(self, model_name: str, onnx_path: Path):
+        """Exportiert das Modell nach ONNX und quantisiert MatMuls dynamisch auf INT8."""
+        from optimum.exporters.onnx import main_export
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        export_dir = onnx_path.parent / "fp32"
+        logger.info(f"Exportiere {model_name} nach ONNX: {export_dir}")
+        main_export(model_name, output=export_dir, task="feature-extraction")
+
+        logger.info(f"Quantisiere ONNX-Modell (INT8): {onnx_path}")
+        quantize_dynamic(
+            export_dir / "model.onnx",
+            onnx_path,
+            weight_type=QuantType.QInt8,
+            op_types_to_quantize=["MatMul"],
+        )
+
+    def _load_sentence_transformer(self):
+        """Lädt das Embedding-Modell als SentenceTransformer (FP32)."""
+        # Lazy Import — torch/sentence-transformers nur laden, wenn benötigt
+        from sentence_transformers import SentenceTransformer
+
         logger.info(
             f"Lade Embedding-Modell: {self._settings.embedding_model} "
             f"auf {self._settings.embedding_device}"
@@ -48,48 +260,120 @@ class EmbeddingService:
         )
 
     def is_ready(self) -> bool:
-        return self._model is not None
+        return self._model is not None or self._session is not None
 
     @property
     def dimension(self) -> int:
         return self._dimension
 
-    async def embed(self, texts: Union[str, list[str]]) -> list[list[float]]:
+    async def embed(
+        self, texts: Union[str, list[str]], prefix: str = ""
+    ) -> np.ndarray:
         """
         Erzeugt Embeddings für einen oder mehrere Texte.
+        Gibt ein float32-Array der Form (N, dimension) zurück.
         
         multilingual-e5-large erwartet Präfixe:
           - "query: " für Suchanfragen
           - "passage: " für Dokumente/Chunks
         
-        Diese Methode wird intern aufgerufen — Präfixe müssen vorher gesetzt sein.
+        Das Präfix wird separat übergeben; im ONNX-Pfad wird es nur einmal
+        beim Laden tokenisiert und den Token-IDs jedes Textes vorangestellt.
         """
-        if self._model is None:
+        if not self.is_ready():
             raise RuntimeError("Embedding-Modell nicht initialisiert.")
 
         if isinstance(texts, str):
             texts = [texts]
 
-        loop = asyncio.get_event_loop()
+        loop = asyncio.get_running_loop()
         embeddings = await loop.run_in_executor(
-            None,
-            lambda: self._model.encode(
-                texts,
-                batch_size=self._settings.embedding_batch_size,
-                normalize_embeddings=True,
-                show_progress_bar=False,
-            ),
+            self._executor, self._encode, texts, prefix
+        )
+
+        return np.asarray(embeddings, dtype=np.float32)
+
+    def _encode(self, texts: list[str], prefix: str) -> np.ndarray:
+        """Synchrones Encoding (wird in Thread ausgeführt)."""
+        if self._session is not None:
+            return self._encode_onnx(texts, self._prefix_ids[prefix])
+        return self._model.encode(
+            [f"{prefix}{text}" for text in texts],
+            batch_size=self._settings.embedding_batch_size,
+            normalize_embeddings=True,
+            show_progress_bar=False,
         )
 
-        return embeddings.tolist()
+    def _encode_onnx(self, texts: list[str], prefix_ids: list[int]) -> np.ndarray:
+        """Tokenisieren → ONNX-Encoder → Mean-Pooling → L2-Normalisierung."""
+        batch_size = self._settings.embedding_batch_size
+        # Platz für Präfix sowie CLS/SEP reservieren
+        budget = self._settings.embedding_max_length - len(prefix_ids) - 2
+        cls_id = self._tokenizer.cls_token_id
+        sep_id = self._tokenizer.sep_token_id
+        pad_id = self._tokenizer.pad_token_id
+        results = []
+
+        for i in range(0, len(texts), batch_size):
+            token_ids = self._tokenizer(
+                texts[i : i + batch_size],
+                add_special_tokens=False,
+                truncation=True,
+                max_length=budget,
+            )["input_ids"]
+            sequences = [[cls_id, *prefix_ids, *ids, sep_id] for ids in token_ids]
+
+            seq_len = max(len(seq) for seq in sequences)
+            input_ids = np.full((len(sequences), seq_len), pad_id, dtype=np.int64)
+            attention_mask = np.zeros((len(sequences), seq_len), dtype=np.int64)
+            for row, seq in enumerate(sequences):
+                input_ids[row, : len(seq)] = seq
+                attention_mask[row, : len(seq)] = 1
+
+            feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if "token_type_ids" in self._onnx_inputs:
+                feeds["token_type_ids"] = np.zeros_like(input_ids)
+            hidden = self._session.run(None, feeds)[0]
+            results.append(self._pool(hidden, attention_mask))
+
+        return np.concatenate(results)
+
+    @staticmethod
+    def _query_cache_key(query: str) -> bytes:
+        """Cache-Key: Groß-/Kleinschreibung und Whitespace werden ignoriert."""
+        normalized = " ".join(query.casefold().split())
+        return fast_digest(normalized.encode())
+
+    async def embed_query(self, query: str) -> np.ndarray:
+        """
+        Embedding für eine Suchanfrage (mit 'query: '-Präfix).
+        Wiederholte Anfragen werden aus dem LRU-Cache bedient, bis der
+        Eintrag älter als embedding_query_cache_ttl Sekunden ist.
+        """
+        key = self._query_cache_key(query)
+        now = time.monotonic()
+        cached = self._query_cache.get(key)
+        if cached is not None:
+            created, embedding = cached
+            if now - created < self._settings.embedding_query_cache_ttl:
+                self._query_cache.move_to_end(key)
+                return embedding
+            del self._query_cache[key]
+
+        # Modell-Aufruf ohne Lock — parallele Cache-Misses laufen gleichzeitig
+        results = await self.embed(query, prefix=QUERY_PREFIX)
+        embedding = results[0]
+        # Gecachte Arrays werden geteilt → schreibgeschützt
+        embedding.flags.writeable = False
+
+        # Mutationen laufen ohne await dazwischen → atomar im Event-Loop
+        self._query_cache[key] = (now, embedding)
+        self._query_cache.move_to_end(key)
+        while len(self._query_cache) > self._settings.embedding_query_cache_size:
+            self._query_cache.popitem(last=False)
 
-    async def embed_query(self, query: str) -> list[float]:
-        """Embedding für eine Suchanfrage (mit 'query: '-Präfix)."""
-        prefixed = f"query: {query}"
-        results = await self.embed(prefixed)
-        return results[0]
+        return embedding
 
-    async def embed_documents(self, documents: list[str]) -> list[list[float]]:
+    async def embed_documents(self, documents: list[str]) -> np.ndarray:
         """Embeddings für Dokument-Chunks (mit 'passage: '-Präfix)."""
-        prefixed = [f"passage: {doc}" for doc in documents]
-        return await self.embed(prefixed)
+        return await self.embed(documents, prefix=PASSAGE_PREFIX)
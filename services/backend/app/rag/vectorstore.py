@@ -9,26 +9,40 @@ Verwaltet die Vektordatenbank für RAG:
   - Dokumentenverwaltung (Liste, Löschen)
 """
 
+import asyncio
+import os
 import uuid
+from collections import deque
 from typing import Optional
 
+import numpy as np
 from loguru import logger
 from qdrant_client import AsyncQdrantClient
 from qdrant_client.models import (
+    BinaryQuantization,
+    BinaryQuantizationConfig,
     Distance,
     FieldCondition,
     Filter,
+    FilterSelector,
     MatchValue,
+    PayloadSchemaType,
     PointStruct,
-    ScalarQuantizationConfig,
-    ScalarType,
+    QuantizationSearchParams,
+    SearchParams,
     VectorParams,
 )
 
+from app.audio.segments import segments_text
 from app.config import get_settings
 from app.rag.embedding import EmbeddingService
 from app.rag.chunking import TextChunker
 
+# Obergrenze für list_documents (eine Gruppe je Dokument)
+MAX_LISTED_DOCUMENTS = 10_000
+# Gleichzeitige count-RPCs in list_documents (Qdrant nicht fluten)
+MAX_CONCURRENT_COUNTS = 16
+
 
 class VectorStoreService:
     """Qdrant-basierter Vectorstore mit Embedding-Integration."""
@@ -38,12 +52,20 @@ class VectorStoreService:
         self._embedding = embedding_service
         self._chunker = TextChunker()
         self._settings = get_settings()
+        # Letzte Suchen (Embedding, Parameter, Ergebnisse) für wiederholte
+        # Anfragen (z.B. "Neu generieren" in Open WebUI)
+        self._recent_searches: deque[tuple[np.ndarray, tuple, list[dict]]] = deque(
+            maxlen=self._settings.rag_recent_queries
+        )
 
     async def initialize(self):
         """Verbindung herstellen und Collection sicherstellen."""
         self._client = AsyncQdrantClient(
             host=self._settings.qdrant_host,
             port=self._settings.qdrant_port,
+            # gRPC: Vektoren als Protobuf statt JSON-Float-Listen
+            grpc_port=self._settings.qdrant_grpc_port,
+            prefer_grpc=self._settings.qdrant_prefer_grpc,
             timeout=30,
         )
         await self._ensure_collection()
@@ -72,15 +94,24 @@ class VectorStoreService:
                     size=self._embedding.dimension,
                     distance=Distance.COSINE,
                 ),
-                quantization_config=ScalarQuantizationConfig(
-                    type=ScalarType.INT8,
-                    always_ram=True,
+                quantization_config=BinaryQuantization(
+                    binary=BinaryQuantizationConfig(always_ram=True),
                 ),
             )
-            logger.info(f"Collection '{collection_name}' erstellt (INT8 Quantisierung)")
+            logger.info(
+                f"Collection '{collection_name}' erstellt (Binär-Quantisierung)"
+            )
         else:
             logger.info(f"Collection '{collection_name}' existiert bereits.")
 
+        # Payload-Indizes für Gruppierung/Filter nach Dokument (idempotent)
+        for field_name in ("document_id", "document_hash"):
+            await self._client.create_payload_index(
+                collection_name=collection_name,
+                field_name=field_name,
+                field_schema=PayloadSchemaType.KEYWORD,
+            )
+
     async def recreate_collection(self):
         """Löscht und erstellt die Collection neu."""
         collection_name = self._settings.qdrant_collection
@@ -89,6 +120,7 @@ class VectorStoreService:
             logger.info(f"Collection '{collection_name}' gelöscht.")
         except Exception:
             pass
+        self._recent_searches.clear()
         await self._ensure_collection()
 
     # ------------------------------------------------------------------
@@ -99,39 +131,87 @@ class VectorStoreService:
         Chunked einen Text, erzeugt Embeddings und speichert in Qdrant.
         Gibt die Anzahl indizierter Chunks zurück.
         """
-        # Text in Chunks aufteilen
-        chunks = self._chunker.chunk(text)
+        return await self.add_texts([text], [metadata])
+
+    async def add_texts(self, texts: list[str], metadatas: list[dict]) -> int:
+        """
+        Indexiert mehrere Texte (z.B. alle Seiten eines PDFs) in einem Durchlauf.
+        Die Chunks aller Texte werden gemeinsam in Batches der Größe
+        embedding_batch_size embedded und upserted — statt je Text eigene,
+        meist halbvolle Batches und Round-Trips.
+
+        Embedding und Upsert laufen als Pipeline: Während ein Mini-Batch
+        nach Qdrant geschrieben wird, wird bereits der nächste embedded.
+        """
+        chunks: list[str] = []
+        payloads: list[dict] = []
+        for text, metadata in zip(texts, metadatas, strict=True):
+            text_chunks = self._chunker.chunk(text)
+            chunks.extend(text_chunks)
+            payloads.extend([metadata] * len(text_chunks))
         if not chunks:
             return 0
 
-        # Embeddings erzeugen
-        embeddings = await self._embedding.embed_documents(chunks)
-
-        # In Qdrant speichern
-        points = []
-        for chunk_text, embedding in zip(chunks, embeddings):
-            point_id = str(uuid.uuid4())
-            points.append(
-                PointStruct(
-                    id=point_id,
-                    vector=embedding,
-                    payload={
-                        "text": chunk_text,
-                        **metadata,
-                    },
+        batch_size = self._settings.embedding_batch_size
+        queue: asyncio.Queue = asyncio.Queue(maxsize=2)
+
+        async def produce():
+            for i in range(0, len(chunks), batch_size):
+                batch = chunks[i : i + batch_size]
+                embeddings = await self._embedding.embed_documents(batch)
+                await queue.put((batch, embeddings, payloads[i : i + batch_size]))
+            await queue.put(None)
+
+        async def consume():
+            while (item := await queue.get()) is not None:
+                batch, embeddings, batch_payloads = item
+                # wait=True: abgelehnte Batches melden sich hier als Fehler;
+                # die Latenz verdeckt die Pipeline (nächster Batch wird embedded)
+                await self._client.upsert(
+                    collection_name=self._settings.qdrant_collection,
+                    points=self._build_points(batch, embeddings, batch_payloads),
+                    wait=True,
                 )
-            )
-
-        await self._client.upsert(
-            collection_name=self._settings.qdrant_collection,
-            points=points,
-        )
 
-        return len(points)
+        # TaskGroup bricht bei einem Fehler die jeweils andere Stufe ab;
+        # Aufrufer sehen die eigentliche Ursache statt der ExceptionGroup
+        try:
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(produce())
+                tg.create_task(consume())
+        except ExceptionGroup as eg:
+            raise eg.exceptions[0]
+
+        # Neue Inhalte → zwischengespeicherte Suchergebnisse veraltet
+        self._recent_searches.clear()
+        return len(chunks)
+
+    @staticmethod
+    def _build_points(
+        chunks: list[str], embeddings: np.ndarray, payloads: list[dict]
+    ) -> list[PointStruct]:
+        """Baut PointStructs; u64-IDs aus einem einzigen urandom-Aufruf."""
+        raw = os.urandom(8 * len(chunks))
+        ids = [int.from_bytes(raw[i : i + 8], "little") for i in range(0, len(raw), 8)]
+        return [
+            PointStruct(
+                id=point_id,
+                vector=embedding.tolist(),
+                payload={"text": chunk_text, **payload},
+            )
+            for point_id, chunk_text, embedding, payload in zip(
+                ids, chunks, embeddings, payloads
+            )
+        ]
 
     async def add_transcript(self, transcript: dict, patient_id: str) -> int:
         """Indexiert ein Transkript mit Patienten-Metadaten."""
-        text = transcript.get("text", "")
+        segments = transcript.get("segments")
+        if segments:
+            # Zu kurze Segmente vor dem Indexieren verwerfen (vektorisiert)
+            text = segments_text(segments, self._settings.stt_min_segment_duration)
+        else:
+            text = transcript.get("text", "")
         metadata = {
             "source": transcript.get("filename", "audio_transcript"),
             "document_type": "transcript",
@@ -150,14 +230,27 @@ class VectorStoreService:
         query: str,
         top_k: int = 5,
         filters: Optional[dict] = None,
+        score_threshold: Optional[float] = None,
     ) -> list[dict]:
         """
         Ähnlichkeitssuche in Qdrant.
         Gibt Liste von {text, score, metadata} zurück.
+        Mit score_threshold filtert Qdrant schwache Treffer serverseitig.
         """
         # Query embedden
         query_embedding = await self._embedding.embed_query(query)
 
+        # Identische letzte Anfrage mit gleichen Parametern → Ergebnis wiederverwenden
+        params = (
+            top_k,
+            tuple(sorted(filters.items())) if filters else None,
+            score_threshold,
+        )
+        recent = self._find_recent_search(query_embedding, params)
+        if recent is not None:
+            logger.debug("RAG: Ergebnis einer identischen Anfrage wiederverwendet")
+            return self._copy_results(recent)
+
         # Filter aufbauen
         qdrant_filter = None
         if filters:
@@ -175,6 +268,16 @@ class VectorStoreService:
             query=query_embedding,
             limit=top_k,
             query_filter=qdrant_filter,
+            score_threshold=score_threshold,
+            # HNSW auf Binärvektoren, Top-Kandidaten mit Originalvektoren neu bewerten
+            search_params=SearchParams(
+                hnsw_ef=self._settings.rag_hnsw_ef,
+                quantization=QuantizationSearchParams(
+                    ignore=False,
+                    rescore=True,
+                    oversampling=self._settings.rag_oversampling,
+                ),
+            ),
             with_payload=True,
         )
 
@@ -192,79 +295,151 @@ class VectorStoreService:
                 }
             )
 
+        self._recent_searches.append(
+            (query_embedding, params, self._copy_results(formatted))
+        )
         return formatted
 
+    def _find_recent_search(
+        self, query_embedding: np.ndarray, params: tuple
+    ) -> Optional[list[dict]]:
+        """
+        Sucht unter den letzten Anfragen eine mit identischem Embedding (gleiche
+        Anfrage nach Normalisierung von Groß-/Kleinschreibung und Whitespace,
+        siehe Query-Cache). Kein Ähnlichkeitsschwellwert: E5-Scores liegen
+        dicht bei 1, Anfragen mit anderem Namen oder Datum wären sonst
+        "Duplikate" – mit den Quellen einer fremden Anfrage.
+        """
+        for embedding, entry_params, results in self._recent_searches:
+            if entry_params == params and np.array_equal(embedding, query_embedding):
+                return results
+        return None
+
+    @staticmethod
+    def _copy_results(results: list[dict]) -> list[dict]:
+        """Kopien der Treffer, damit Aufrufer den Puffer nicht verändern."""
+        return [{**r, "metadata": dict(r["metadata"])} for r in results]
+
     # ------------------------------------------------------------------
     # Verwaltung
     # ------------------------------------------------------------------
     async def list_documents(self) -> list[dict]:
-        """Listet unterschiedliche Dokumente (gruppiert nach document_id)."""
-        # Scroll durch alle Punkte, nur Metadaten
-        documents = {}
-        offset = None
-        batch_size = 100
-
-        while True:
-            results = await self._client.scroll(
-                collection_name=self._settings.qdrant_collection,
-                limit=batch_size,
-                offset=offset,
-                with_payload=True,
-                with_vectors=False,
+        """
+        Listet unterschiedliche Dokumente (gruppiert nach document_id).
+        Gruppierung erfolgt serverseitig; Chunk-Zahlen über parallele Counts
+        (höchstens MAX_CONCURRENT_COUNTS gleichzeitig).
+        """
+        collection_name = self._settings.qdrant_collection
+        result = await self._client.query_points_groups(
+            collection_name=collection_name,
+            group_by="document_id",
+            limit=MAX_LISTED_DOCUMENTS,
+            group_size=1,
+            with_payload=True,
+            with_vectors=False,
+        )
+
+        documents = []
+        for group in result.groups:
+            payload = group.hits[0].payload or {}
+            documents.append(
+                {
+                    "document_id": group.id,
+                    "source": payload.get("source", ""),
+                    "document_type": payload.get("document_type", ""),
+                    "patient_id": payload.get("patient_id", ""),
+                    "case_number": payload.get("case_number", ""),
+                    "total_pages": payload.get("total_pages", 0),
+                    "chunks": 0,
+                }
             )
-            points, next_offset = results
-
-            for point in points:
-                doc_id = point.payload.get("document_id", "unknown")
-                if doc_id not in documents:
-                    documents[doc_id] = {
-                        "document_id": doc_id,
-                        "source": point.payload.get("source", ""),
-                        "document_type": point.payload.get("document_type", ""),
-                        "patient_id": point.payload.get("patient_id", ""),
-                        "case_number": point.payload.get("case_number", ""),
-                        "total_pages": point.payload.get("total_pages", 0),
-                        "chunks": 0,
-                    }
-                documents[doc_id]["chunks"] += 1
-
-            if next_offset is None:
-                break
-            offset = next_offset
-
-        return list(documents.values())
 
-    async def delete_document(self, document_id: str) -> int:
-        """Löscht alle Chunks eines Dokuments."""
-        # Zähle zuerst die Punkte
-        results = await self._client.scroll(
-            collection_name=self._settings.qdrant_collection,
+        count_slots = asyncio.Semaphore(MAX_CONCURRENT_COUNTS)
+
+        async def count_chunks(document_id: str):
+            async with count_slots:
+                return await self._client.count(
+                    collection_name=collection_name,
+                    count_filter=self._document_filter(document_id),
+                    exact=True,
+                )
+
+        counts = await asyncio.gather(
+            *[count_chunks(doc["document_id"]) for doc in documents]
+        )
+        for doc, count in zip(documents, counts):
+            doc["chunks"] = count.count
+
+        return documents
+
+    async def find_document_by_hash(
+        self, document_hash: str, patient_id: str = "", case_number: str = ""
+    ) -> Optional[dict]:
+        """
+        Sucht ein bereits indexiertes Dokument anhand seines Inhalts-Hashes,
+        beschränkt auf denselben Patienten und dasselbe Aktenzeichen (dieselbe
+        PDF bei einem anderen Patienten ist kein Duplikat).
+        Gibt {document_id, total_pages, chunks} zurück oder None.
+        """
+        collection_name = self._settings.qdrant_collection
+        points, _ = await self._client.scroll(
+            collection_name=collection_name,
             scroll_filter=Filter(
                 must=[
                     FieldCondition(
-                        key="document_id", match=MatchValue(value=document_id)
-                    )
+                        key="document_hash", match=MatchValue(value=document_hash)
+                    ),
+                    FieldCondition(key="patient_id", match=MatchValue(value=patient_id)),
+                    FieldCondition(key="case_number", match=MatchValue(value=case_number)),
                 ]
             ),
-            limit=10000,
-            with_payload=False,
+            limit=1,
+            with_payload=True,
             with_vectors=False,
         )
-        count = len(results[0])
+        if not points:
+            return None
+
+        payload = points[0].payload or {}
+        document_id = payload.get("document_id", "")
+        count = await self._client.count(
+            collection_name=collection_name,
+            count_filter=self._document_filter(document_id),
+            exact=True,
+        )
+        return {
+            "document_id": document_id,
+            "total_pages": payload.get("total_pages", 0),
+            "chunks": count.count,
+        }
+
+    @staticmethod
+    def _document_filter(document_id: str) -> Filter:
+        """Filter auf alle Chunks eines Dokuments."""
+        return Filter(
+            must=[FieldCondition(key="document_id", match=MatchValue(value=document_id))]
+        )
+
+    async def delete_document(self, document_id: str) -> int:
+        """Löscht alle Chunks eines Dokuments."""
+        collection_name = self._settings.qdrant_collection
+        document_filter = self._document_filter(document_id)
+
+        # Zähle zuerst die Punkte (serverseitig, ohne ID-Transfer)
+        result = await self._client.count(
+            collection_name=collection_name,
+            count_filter=document_filter,
+            exact=True,
+        )
 
         # Löschen
         await self._client.delete(
-            collection_name=self._settings.qdrant_collection,
-            points_selector=Filter(
-                must=[
-                    FieldCondition(
-                        key="document_id", match=MatchValue(value=document_id)
-                    )
-                ]
-            ),
+            collection_name=collection_name,
+            points_selector=FilterSelector(filter=document_filter),
         )
+        self._recent_searches.clear()
 
-        return count
+        return result.count
 
     async def get_stats(self) -> dict:
         """Statistiken der Collection."""
@@ -11,21 +11,62 @@ Zusätzlich:
   - POST /v1/audio/denoise         → Audio-Bereinigung
 """
 
-import io
 import tempfile
 import time
 from pathlib import Path
 from typing import Optional
 
 import httpx
+import orjson
 from fastapi import APIRouter, File, Form, Request, UploadFile, HTTPException
 from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from loguru import logger
 
 from app.config import get_settings
+from app.utils.multipart import multipart_file_body
 
 router = APIRouter()
 
+# Content-Types der TTS-Ausgabeformate
+_TTS_CONTENT_TYPES = {
+    "wav": "audio/wav",
+    "mp3": "audio/mpeg",
+    "opus": "audio/opus",
+}
+
+# Form-Werte für Bool-Parameter der GPU-Services
+_BOOL_STR = {True: "true", False: "false"}
+
+_MB = 1024 * 1024
+
+
+async def _send_streaming(
+    client: httpx.AsyncClient, upstream_request: httpx.Request
+) -> httpx.Response:
+    """
+    Sendet eine Anfrage an einen GPU-Service und gibt die Antwort mit noch
+    ungelesenem Body zurück. Der Status wird vorab geprüft, damit Fehler als
+    502 statt als abgebrochener Stream beim Client ankommen.
+    """
+    resp = await client.send(upstream_request, stream=True)
+    if resp.is_error:
+        await resp.aclose()
+        resp.raise_for_status()
+    return resp
+
+
+def _proxy_response(
+    resp: httpx.Response, media_type: str, filename: str
+) -> StreamingResponse:
+    """Reicht den Upstream-Body unverändert durch; Verbindung danach schließen."""
+    return StreamingResponse(
+        resp.aiter_raw(),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+        background=BackgroundTask(resp.aclose),
+    )
+
 
 # ---------------------------------------------------------------------------
 # POST /v1/audio/transcriptions — OpenAI-kompatible STT
@@ -49,18 +90,17 @@ async def transcribe_audio(
     if not stt.is_ready():
         raise HTTPException(status_code=503, detail="STT-Service nicht bereit.")
 
-    # Audio lesen
-    audio_bytes = await file.read()
-    if len(audio_bytes) == 0:
+    # Upload ist bereits von Starlette gespoolt → Dateiobjekt direkt nutzen
+    if not file.size:
         raise HTTPException(status_code=400, detail="Leere Audio-Datei.")
 
     logger.info(
-        f"STT-Anfrage: {file.filename}, {len(audio_bytes)} bytes, Sprache: {language or settings.stt_language}"
+        f"STT-Anfrage: {file.filename}, {file.size} bytes, Sprache: {language or settings.stt_language}"
     )
 
     try:
         result = await stt.transcribe(
-            audio_bytes=audio_bytes,
+            audio=file.file,
             language=language or settings.stt_language,
         )
 
@@ -88,9 +128,10 @@ async def text_to_speech(request: Request):
     Konvertiert Text zu Sprache (XTTS-v2).
     OpenAI-kompatibles Format für Open WebUI.
     """
-    settings = get_settings()
-
-    body = await request.json()
+    try:
+        body = orjson.loads(await request.body())
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Ungültiger JSON-Body.")
     text = body.get("input", "")
     voice = body.get("voice", "default")
     response_format = body.get("response_format", "wav")
@@ -101,30 +142,26 @@ async def text_to_speech(request: Request):
     logger.info(f"TTS-Anfrage: {len(text)} Zeichen, Stimme: {voice}")
 
     try:
-        async with httpx.AsyncClient(timeout=120) as client:
-            resp = await client.post(
-                f"{settings.tts_service_url}/synthesize",
+        client = request.app.state.http
+        resp = await _send_streaming(
+            client,
+            client.build_request(
+                "POST",
+                request.app.state.urls.tts,
                 json={
                     "text": text,
                     "language": "de",
                     "voice": voice,
                     "format": response_format,
                 },
-            )
-            resp.raise_for_status()
+                timeout=120,
+            ),
+        )
 
-        content_type = {
-            "wav": "audio/wav",
-            "mp3": "audio/mpeg",
-            "opus": "audio/opus",
-        }.get(response_format, "audio/wav")
-
-        return StreamingResponse(
-            io.BytesIO(resp.content),
-            media_type=content_type,
-            headers={
-                "Content-Disposition": f"attachment; filename=speech.{response_format}"
-            },
+        return _proxy_response(
+            resp,
+            media_type=_TTS_CONTENT_TYPES.get(response_format, "audio/wav"),
+            filename=f"speech.{response_format}",
         )
 
     except httpx.HTTPError as e:
@@ -153,37 +190,51 @@ async def transcribe_long_audio(
     if not stt.is_ready():
         raise HTTPException(status_code=503, detail="STT-Service nicht bereit.")
 
-    audio_bytes = await file.read()
-    if len(audio_bytes) == 0:
+    if not file.size:
         raise HTTPException(status_code=400, detail="Leere Audio-Datei.")
 
-    logger.info(
-        f"Langform-Transkription: {file.filename}, {len(audio_bytes) / 1024 / 1024:.1f} MB, "
-        f"Denoise: {denoise}, Patient: {patient_id or 'anonym'}"
+    # lazy: Formatierung nur, wenn INFO tatsächlich geloggt wird
+    logger.opt(lazy=True).info(
+        "Langform-Transkription: {}, {:.1f} MB, Denoise: {}, Patient: {}",
+        lambda: file.filename,
+        lambda: file.size / _MB,
+        lambda: denoise,
+        lambda: patient_id or "anonym",
     )
 
+    # Ohne Bereinigung wird direkt aus dem gespoolten Upload transkribiert
+    audio = file.file
+
     # --- Optionale Audio-Bereinigung ---
     if denoise:
         try:
             logger.info("Starte Audio-Bereinigung...")
-            async with httpx.AsyncClient(timeout=600) as client:
-                resp = await client.post(
-                    f"{settings.denoiser_service_url}/denoise",
-                    files={"file": (file.filename, audio_bytes, file.content_type)},
-                    data={"enhance": "true"},
-                )
-                resp.raise_for_status()
-                audio_bytes = resp.content
-                logger.info(
-                    f"Audio bereinigt: {len(audio_bytes) / 1024 / 1024:.1f} MB"
-                )
+            client = request.app.state.http
+            headers, body = multipart_file_body(
+                file.file,
+                file.filename,
+                file.content_type,
+                file.size,
+                data={"enhance": "true"},
+            )
+            resp = await client.post(
+                request.app.state.urls.denoise,
+                content=body,
+                headers=headers,
+                timeout=600,
+            )
+            resp.raise_for_status()
+            audio = resp.content
+            logger.opt(lazy=True).info(
+                "Audio bereinigt: {:.1f} MB", lambda: len(audio) / _MB
+            )
         except Exception as e:
             logger.warning(f"Audio-Bereinigung fehlgeschlagen, nutze Original: {e}")
 
     # --- Transkription ---
     try:
         result = await stt.transcribe(
-            audio_bytes=audio_bytes,
+            audio=audio,
             language=language or settings.stt_language,
             word_timestamps=True,
         )
@@ -224,6 +275,7 @@ async def transcribe_long_audio(
 # ---------------------------------------------------------------------------
 @router.post("/audio/denoise")
 async def denoise_audio(
+    request: Request,
     file: UploadFile = File(...),
     enhance: bool = Form(True),
 ):
@@ -231,31 +283,38 @@ async def denoise_audio(
     Bereinigt Audio-Dateien (Hintergrundgeräusche entfernen + optional Enhancen).
     Nutzt Resemble Enhance Service.
     """
-    settings = get_settings()
-    audio_bytes = await file.read()
-
-    if len(audio_bytes) == 0:
+    if not file.size:
         raise HTTPException(status_code=400, detail="Leere Audio-Datei.")
 
-    logger.info(
-        f"Denoising: {file.filename}, {len(audio_bytes) / 1024 / 1024:.1f} MB, Enhance: {enhance}"
+    logger.opt(lazy=True).info(
+        "Denoising: {}, {:.1f} MB, Enhance: {}",
+        lambda: file.filename,
+        lambda: file.size / _MB,
+        lambda: enhance,
     )
 
     try:
-        async with httpx.AsyncClient(timeout=600) as client:
-            resp = await client.post(
-                f"{settings.denoiser_service_url}/denoise",
-                files={"file": (file.filename, audio_bytes, file.content_type)},
-                data={"enhance": str(enhance).lower()},
-            )
-            resp.raise_for_status()
+        client = request.app.state.http
+        headers, body = multipart_file_body(
+            file.file,
+            file.filename,
+            file.content_type,
+            file.size,
+            data={"enhance": _BOOL_STR[enhance]},
+        )
+        resp = await _send_streaming(
+            client,
+            client.build_request(
+                "POST",
+                request.app.state.urls.denoise,
+                content=body,
+                headers=headers,
+                timeout=600,
+            ),
+        )
 
-        return StreamingResponse(
-            io.BytesIO(resp.content),
-            media_type="audio/wav",
-            headers={
-                "Content-Disposition": f"attachment; filename=denoised_{file.filename}"
-            },
+        return _proxy_response(
+            resp, media_type="audio/wav", filename=f"denoised_{file.filename}"
         )
 
     except httpx.HTTPError as e:
@@ -6,16 +6,17 @@ Implementiert /v1/chat/completions und /v1/models.
 Integriert RAG-Pipeline: Frage → Embedding → Qdrant → Kontext → LLM.
 """
 
-import json
-import time
+import asyncio
 import uuid
 from typing import Optional
 
 import httpx
+import orjson
 from fastapi import APIRouter, Request, HTTPException
 from fastapi.responses import StreamingResponse
 from loguru import logger
 from pydantic import BaseModel, Field
+from starlette.background import BackgroundTask
 
 from app.config import get_settings
 
@@ -65,21 +66,9 @@ class ChatCompletionRequest(BaseModel):
 # /v1/models — Modell-Liste für Open WebUI
 # ---------------------------------------------------------------------------
 @router.get("/models")
-async def list_models():
-    settings = get_settings()
-    model_id = settings.llm_model.split("/")[-1]
-    return {
-        "object": "list",
-        "data": [
-            {
-                "id": model_id,
-                "object": "model",
-                "created": int(time.time()),
-                "owned_by": "local",
-                "permission": [],
-            }
-        ],
-    }
+async def list_models(request: Request):
+    # Beim Start vorberechnet (siehe lifespan) — Open WebUI pollt diesen Endpunkt häufig
+    return request.app.state.models_payload
 
 
 # ---------------------------------------------------------------------------
@@ -99,45 +88,57 @@ async def chat_completions(request: Request, body: ChatCompletionRequest):
     if not user_message:
         raise HTTPException(status_code=400, detail="Keine User-Nachricht gefunden.")
 
-    # --- RAG: Relevante Kontexte aus Qdrant abrufen ---
+    # --- RAG: Suche sofort starten, Vorbereitung läuft parallel ---
+    search_task = asyncio.create_task(
+        request.app.state.vectorstore.search(
+            user_message,
+            top_k=settings.rag_top_k,
+            # Relevanzschwelle direkt in Qdrant anwenden
+            score_threshold=settings.rag_similarity_threshold,
+        )
+    )
+
+    # Chat-Verlauf für das LLM (unabhängig vom RAG-Kontext)
+    history = [
+        {"role": msg.role, "content": msg.content}
+        for msg in body.messages
+        if msg.role != "system"
+    ]
+
     context = ""
     sources = []
     try:
-        vectorstore = request.app.state.vectorstore
-        results = await vectorstore.search(user_message, top_k=settings.rag_top_k)
+        results = await search_task
 
         if results:
-            context_parts = []
-            for i, result in enumerate(results, 1):
-                score = result.get("score", 0)
-                if score >= settings.rag_similarity_threshold:
-                    text = result.get("text", "")
-                    source = result.get("metadata", {}).get("source", "Unbekannt")
-                    page = result.get("metadata", {}).get("page", "?")
-                    context_parts.append(
-                        f"[Quelle {i}: {source}, S.{page}] (Relevanz: {score:.2f})\n{text}"
-                    )
-                    sources.append({"source": source, "page": page, "score": score})
-
-            context = "\n\n---\n\n".join(context_parts)
-            logger.info(
-                f"RAG: {len(context_parts)} relevante Kontexte gefunden "
-                f"(von {len(results)} Ergebnissen)"
+            sources = [
+                {
+                    "source": result["metadata"].get("source", "Unbekannt"),
+                    "page": result["metadata"].get("page", "?"),
+                    "score": result["score"],
+                }
+                for result in results
+            ]
+            context = "\n\n---\n\n".join(
+                [
+                    f"[Quelle {i}: {src['source']}, S.{src['page']}] "
+                    f"(Relevanz: {src['score']:.2f})\n{result['text']}"
+                    for i, (result, src) in enumerate(zip(results, sources), 1)
+                ]
             )
+            logger.info(f"RAG: {len(results)} relevante Kontexte gefunden")
     except Exception as e:
         logger.warning(f"RAG-Suche fehlgeschlagen: {e}")
         context = "[Wissensdatenbank nicht verfügbar]"
 
     # --- System-Prompt mit Kontext zusammenbauen ---
-    system_content = SYSTEM_PROMPT.format(
-        context=context if context else "[Keine relevanten Dokumente gefunden]"
+    # str.replace statt .format: nur ein Platzhalter, kein Format-Parsing nötig
+    system_content = SYSTEM_PROMPT.replace(
+        "{context}", context if context else "[Keine relevanten Dokumente gefunden]"
     )
 
     # Nachrichten für LLM vorbereiten
-    llm_messages = [{"role": "system", "content": system_content}]
-    for msg in body.messages:
-        if msg.role != "system":
-            llm_messages.append({"role": msg.role, "content": msg.content})
+    llm_messages = [{"role": "system", "content": system_content}, *history]
 
     # --- Anfrage an vLLM weiterleiten ---
     llm_payload = {
@@ -150,56 +151,70 @@ async def chat_completions(request: Request, body: ChatCompletionRequest):
     if body.top_p is not None:
         llm_payload["top_p"] = body.top_p
 
+    client = request.app.state.http
+    llm_url = request.app.state.urls.llm_chat
     try:
         if body.stream:
+            response = await _open_llm_stream(client, llm_url, llm_payload)
             return StreamingResponse(
-                _stream_llm_response(settings.llm_base_url, llm_payload),
+                response.aiter_raw(),
                 media_type="text/event-stream",
+                # Proxy-Pufferung verhindern, damit Tokens sofort durchgereicht werden
+                headers={"X-Accel-Buffering": "no", "Cache-Control": "no-cache"},
+                background=BackgroundTask(response.aclose),
             )
         else:
             return await _complete_llm_response(
-                settings.llm_base_url, llm_payload, sources
+                client, llm_url, llm_payload, sources
             )
     except httpx.HTTPError as e:
         logger.error(f"LLM-Anfrage fehlgeschlagen: {e}")
         raise HTTPException(status_code=502, detail=f"LLM nicht erreichbar: {e}")
 
 
-async def _stream_llm_response(base_url: str, payload: dict):
-    """Streamt die LLM-Antwort als SSE-Events."""
-    async with httpx.AsyncClient(timeout=300) as client:
-        async with client.stream(
-            "POST",
-            f"{base_url}/chat/completions",
-            json=payload,
-            headers={"Content-Type": "application/json"},
-        ) as response:
-            async for line in response.aiter_lines():
-                if line.startswith("data: "):
-                    yield f"{line}\n\n"
-                elif line.strip() == "":
-                    continue
-    yield "data: [DONE]\n\n"
+async def _open_llm_stream(
+    client: httpx.AsyncClient, url: httpx.URL, payload: dict
+) -> httpx.Response:
+    """
+    Startet die Streaming-Anfrage an vLLM und gibt die Antwort mit noch
+    ungelesenem Body zurück. vLLM liefert gültiges SSE inkl. "data: [DONE]"
+    → Bytes unverändert durchreichen. Der Status wird vorab geprüft, damit
+    Fehler als 502 statt als JSON-Body in einem 200-Event-Stream ankommen.
+    """
+    response = await client.send(
+        client.build_request("POST", url, json=payload, timeout=300),
+        stream=True,
+    )
+    if response.is_error:
+        await response.aread()
+        await response.aclose()
+        logger.error(f"vLLM-Fehler {response.status_code}: {response.text[:500]}")
+        response.raise_for_status()
+    return response
 
 
 async def _complete_llm_response(
-    base_url: str, payload: dict, sources: list
+    client: httpx.AsyncClient, url: httpx.URL, payload: dict, sources: list
 ) -> dict:
     """Nicht-Streaming LLM-Antwort mit Quellenangaben."""
-    async with httpx.AsyncClient(timeout=300) as client:
-        resp = await client.post(
-            f"{base_url}/chat/completions",
-            json=payload,
-            headers={"Content-Type": "application/json"},
-        )
-        resp.raise_for_status()
-        result = resp.json()
+    resp = await client.post(
+        url,
+        json=payload,
+        headers={"Content-Type": "application/json"},
+        timeout=300,
+    )
+    resp.raise_for_status()
+    result = orjson.loads(resp.content)
 
     # Quellenangaben an Antwort anhängen
     if sources and result.get("choices"):
-        source_text = "\n\n---\n**Quellen:**\n"
-        for s in sources:
-            source_text += f"- {s['source']}, Seite {s['page']} (Relevanz: {s['score']:.0%})\n"
-        result["choices"][0]["message"]["content"] += source_text
+        lines = ["\n\n---\n**Quellen:**"]
+        lines.extend(
+            f"- {s['source']}, Seite {s['page']} (Relevanz: {s['score']:.0%})"
+            for s in sources
+        )
+        lines.append("")
+        message = result["choices"][0]["message"]
+        message["content"] = "".join((message["content"], "\n".join(lines)))
 
     return result
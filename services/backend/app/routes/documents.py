@@ -9,10 +9,13 @@ import uuid
 from typing import Optional
 
 import httpx
+import orjson
 from fastapi import APIRouter, File, Form, Request, UploadFile, HTTPException
 from loguru import logger
+from starlette.concurrency import run_in_threadpool
 
-from app.config import get_settings
+from app.utils.hash import fast_hash
+from app.utils.multipart import multipart_file_body
 
 router = APIRouter()
 
@@ -34,33 +37,64 @@ async def upload_document(
     2. Markdown-Ergebnis chunken
     3. Chunks embedden und in Qdrant speichern
     """
-    settings = get_settings()
     vectorstore = request.app.state.vectorstore
 
-    pdf_bytes = await file.read()
-    if len(pdf_bytes) == 0:
+    # Upload ist bereits von Starlette gespoolt → nicht komplett einlesen
+    if not file.size:
         raise HTTPException(status_code=400, detail="Leere Datei.")
 
     if not file.filename.lower().endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Nur PDF-Dateien werden unterstützt.")
 
     logger.info(
-        f"Dokument-Upload: {file.filename}, {len(pdf_bytes) / 1024 / 1024:.1f} MB, "
+        f"Dokument-Upload: {file.filename}, {file.size / 1024 / 1024:.1f} MB, "
         f"Typ: {document_type}, Patient: {patient_id or 'k.A.'}, "
         f"Aktenzeichen: {case_number or 'k.A.'}"
     )
 
+    # --- Duplikat-Prüfung über Inhalts-Hash (vor der teuren OCR) ---
+    # Gespoolte Datei liegt ggf. auf Platte → im Threadpool hashen
+    document_hash = await run_in_threadpool(fast_hash, file.file)
+
+    try:
+        existing = await vectorstore.find_document_by_hash(
+            document_hash, patient_id or "", case_number or ""
+        )
+    except Exception as e:
+        logger.warning(f"Duplikat-Prüfung fehlgeschlagen, verarbeite neu: {e}")
+        existing = None
+
+    if existing is not None:
+        logger.info(
+            f"Dokument bereits indexiert: {file.filename} → {existing['document_id']}"
+        )
+        return {
+            "status": "duplicate",
+            "document_id": existing["document_id"],
+            "filename": file.filename,
+            "total_pages": existing["total_pages"],
+            "chunks_indexed": existing["chunks"],
+        }
+
     # --- OCR-Verarbeitung ---
     try:
         logger.info("Sende an OCR-Service...")
-        async with httpx.AsyncClient(timeout=600) as client:
-            resp = await client.post(
-                f"{settings.ocr_service_url}/process",
-                files={"file": (file.filename, pdf_bytes, "application/pdf")},
-                data={"output_format": "markdown"},
-            )
-            resp.raise_for_status()
-            ocr_result = resp.json()
+        client = request.app.state.http
+        headers, body = multipart_file_body(
+            file.file,
+            file.filename,
+            "application/pdf",
+            file.size,
+            data={"output_format": "markdown"},
+        )
+        resp = await client.post(
+            request.app.state.urls.ocr,
+            content=body,
+            headers=headers,
+            timeout=600,
+        )
+        resp.raise_for_status()
+        ocr_result = orjson.loads(resp.content)
 
         markdown_text = ocr_result.get("markdown", "")
         pages = ocr_result.get("pages", [])
@@ -81,37 +115,34 @@ async def upload_document(
         )
 
     # --- Chunking und Indexierung ---
+    doc_id = str(uuid.uuid4())
     try:
-        doc_id = str(uuid.uuid4())
         metadata = {
             "source": file.filename,
             "document_id": doc_id,
+            "document_hash": document_hash,
             "document_type": document_type,
             "patient_id": patient_id or "",
             "case_number": case_number or "",
             "total_pages": total_pages,
         }
 
-        # Seitenweise Chunks erstellen (jede Seite hat Seitennummer)
-        chunks_indexed = 0
+        # Seitenweise Chunks erstellen (jede Seite hat Seitennummer),
+        # alle Seiten in einem gebatchten Aufruf indexieren
         if pages:
-            for page_info in pages:
-                page_text = page_info.get("text", "")
-                page_num = page_info.get("page", 0)
-                if page_text.strip():
-                    page_metadata = {**metadata, "page": page_num}
-                    count = await vectorstore.add_text(
-                        text=page_text,
-                        metadata=page_metadata,
-                    )
-                    chunks_indexed += count
+            indexed_pages = [
+                (page_info.get("text", ""), {**metadata, "page": page_info.get("page", 0)})
+                for page_info in pages
+                if page_info.get("text", "").strip()
+            ]
+            texts = [text for text, _ in indexed_pages]
+            metadatas = [meta for _, meta in indexed_pages]
         else:
             # Fallback: Gesamttext chunken
-            count = await vectorstore.add_text(
-                text=markdown_text,
-                metadata={**metadata, "page": 0},
-            )
-            chunks_indexed = count
+            texts = [markdown_text]
+            metadatas = [{**metadata, "page": 0}]
+
+        chunks_indexed = await vectorstore.add_texts(texts, metadatas)
 
         logger.info(f"Indexiert: {chunks_indexed} Chunks aus {file.filename}")
 
@@ -127,6 +158,12 @@ async def upload_document(
 
     except Exception as e:
         logger.error(f"Indexierung fehlgeschlagen: {e}")
+        # Bereits geschriebene Chunks entfernen – sonst trägt der Teilindex
+        # den Hash und jeder erneute Upload gilt als Duplikat
+        try:
+            await vectorstore.delete_document(doc_id)
+        except Exception as cleanup_error:
+            logger.error(f"Aufräumen von {doc_id} fehlgeschlagen: {cleanup_error}")
         raise HTTPException(
             status_code=500, detail=f"Indexierung fehlgeschlagen: {e}"
         )
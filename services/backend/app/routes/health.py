@@ -7,9 +7,9 @@ router = APIRouter()
 
 
 @router.get("/health")
-async def health():
-    """Einfacher Health-Check für Docker."""
-    return {"status": "ok", "timestamp": datetime.now(timezone.utc).isoformat()}
+async def health(request: Request):
+    """Einfacher Health-Check für Docker (Zeitstempel sekündlich aus lifespan)."""
+    return {"status": "ok", "timestamp": request.app.state.now_iso}
 
 
 @router.get("/health/detail")
@@ -0,0 +1,45 @@
+"""
+Hash-Hilfsfunktionen
+====================
+
+Schnelle Hashes für Dedup- und Cache-Keys (keine Sicherheitsfunktion).
+BLAKE2b ist SIMD-beschleunigt und auf großen Eingaben schneller als
+SHA-256; 128 Bit Digest reichen gegen zufällige Kollisionen.
+"""
+
+import hashlib
+from pathlib import Path
+from typing import BinaryIO, Union
+
+DIGEST_SIZE = 16
+
+# Lesegröße beim Hashen von Dateien
+READ_SIZE = 1024 * 1024
+
+
+def fast_digest(source: Union[bytes, Path, BinaryIO]) -> bytes:
+    """
+    BLAKE2b-Digest von Bytes, einer Datei (Pfad) oder einem Dateiobjekt.
+    Dateien werden blockweise gelesen; ein Dateiobjekt steht danach wieder
+    an seiner ursprünglichen Position.
+    """
+    hasher = hashlib.blake2b(digest_size=DIGEST_SIZE)
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        hasher.update(source)
+    elif isinstance(source, Path):
+        with source.open("rb") as f:
+            while chunk := f.read(READ_SIZE):
+                hasher.update(chunk)
+    else:
+        start = source.tell()
+        while chunk := source.read(READ_SIZE):
+            hasher.update(chunk)
+        source.seek(start)
+
+    return hasher.digest()
+
+
+def fast_hash(source: Union[bytes, Path, BinaryIO]) -> str:
+    """Wie fast_digest, aber als Hex-String (z.B. für Payload-Felder)."""
+    return fast_digest(source).hex()
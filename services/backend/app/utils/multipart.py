@@ -0,0 +1,61 @@
+"""
+Multipart-Hilfsfunktionen
+=========================
+
+Baut multipart/form-data-Bodies für Uploads an die GPU-Services als Stream.
+Die Datei wird blockweise im Threadpool gelesen (gespoolte Uploads liegen
+ggf. auf Platte) und unverändert weitergereicht — kein zusammengesetzter
+Body im Speicher, keine blockierenden Reads im Event-Loop.
+"""
+
+import os
+from typing import AsyncIterator, BinaryIO, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+READ_SIZE = 1024 * 1024
+
+# Wie Browser/httpx: Anführungszeichen und Zeilenumbrüche im Header escapen
+_HEADER_ESCAPES = str.maketrans({'"': "%22", "\r": "%0D", "\n": "%0A"})
+
+
+def multipart_file_body(
+    fileobj: BinaryIO,
+    filename: str,
+    content_type: Optional[str],
+    size: int,
+    data: Optional[dict[str, str]] = None,
+    field_name: str = "file",
+) -> tuple[dict[str, str], AsyncIterator[bytes]]:
+    """
+    Gibt (Header, Body-Iterator) für einen Upload mit einer Datei und
+    optionalen Formularfeldern zurück. ``size`` ist die Restgröße der Datei
+    ab der aktuellen Position; daraus wird Content-Length berechnet, damit
+    der Upstream keinen Chunked-Body erhält.
+    """
+    boundary = os.urandom(16).hex()
+    head = b"".join(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'
+        f"{value}\r\n".encode()
+        for name, value in (data or {}).items()
+    )
+    head += (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="{field_name}"; '
+        f'filename="{filename.translate(_HEADER_ESCAPES)}"\r\n'
+        f"Content-Type: {content_type or 'application/octet-stream'}\r\n\r\n"
+    ).encode()
+    tail = f"\r\n--{boundary}--\r\n".encode()
+
+    headers = {
+        "Content-Type": f"multipart/form-data; boundary={boundary}",
+        "Content-Length": str(len(head) + size + len(tail)),
+    }
+
+    async def body() -> AsyncIterator[bytes]:
+        yield head
+        while chunk := await run_in_threadpool(fileobj.read, READ_SIZE):
+            yield chunk
+        yield tail
+
+    return headers, body()
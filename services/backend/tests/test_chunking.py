@@ -0,0 +1,35 @@
+"""Tests für TextChunker."""
+
+from types import SimpleNamespace
+
+import pytest
+
+from app.rag import chunking
+from app.rag.chunking import MIN_CHUNK_LENGTH, TextChunker
+
+
+@pytest.fixture
+def chunker(monkeypatch):
+    monkeypatch.setattr(
+        chunking,
+        "get_settings",
+        lambda: SimpleNamespace(rag_chunk_size=512, rag_chunk_overlap=64),
+    )
+    return TextChunker()
+
+
+def test_short_text_single_chunk(chunker):
+    assert chunker.chunk("  Kurzer Text.  ") == ["Kurzer Text."]
+
+
+def test_repeated_separators_no_near_duplicates(chunker):
+    """Trennstelle innerhalb der Überlappung → Fenster springt, statt zeichenweise zu kriechen."""
+    para1 = "".join(f"Anamnese, Abschnitt {i}: ausführliche Vorgeschichte. " for i in range(8))
+    para2 = "".join(f"Befund {i} und Beurteilung durch den Sachverständigen. " for i in range(20))
+    chunks = chunker.chunk(para1 + "\n\n\n" + para2)
+
+    assert len(chunks) <= 5
+    assert all(len(c) >= MIN_CHUNK_LENGTH for c in chunks)
+    # Kein Chunk ist vollständig im vorherigen enthalten
+    for previous, current in zip(chunks, chunks[1:]):
+        assert current not in previous
@@ -13,10 +13,13 @@ Endpunkte:
   GET  /health   — Health-Check
 """
 
+import asyncio
 import io
 import os
-import tempfile
+import threading
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import BinaryIO
 
 import numpy as np
 import soundfile as sf
@@ -26,14 +29,55 @@ from fastapi import FastAPI, File, Form, UploadFile, HTTPException
 from fastapi.responses import StreamingResponse
 from loguru import logger
 
-app = FastAPI(title="Denoiser Service", version="1.0.0")
-
 DEVICE = os.getenv("DENOISER_DEVICE", "cuda")
+COMPILE = os.getenv("DENOISER_COMPILE", "true").lower() == "true"
+AUTOCAST = DEVICE == "cuda" and os.getenv("DENOISER_AUTOCAST", "true").lower() == "true"
+
+# cuDNN-Autotuning + TF32: Algorithmus-Suche je Input-Shape einmalig (beim
+# Warmup), danach schnellere Kernel; TF32-Matmuls auf Ampere+ bei
+# vernachlässigbarem Genauigkeitsverlust
+torch.backends.cudnn.benchmark = True
+torch.backends.cudnn.allow_tf32 = True
+torch.backends.cuda.matmul.allow_tf32 = True
+torch.set_float32_matmul_precision("high")
+
+# TorchScript: Profiling-Executor aus. Dieser rekompiliert den Graphen beim
+# zweiten Aufruf mit Profil-Infos → Latenzspitze beim ersten echten Request
+# nach dem Warmup. Ohne Profiling nur statische Graph-Optimierung, dafür
+# gleichmäßige Latenz je Request.
+torch._C._jit_set_profiling_executor(False)
+torch._C._jit_set_profiling_mode(False)
+
+# Kompilier-Caches (Inductor, Triton, CUDA-JIT) im Modell-Volume, damit
+# Neustarts bereits kompilierte Kernel wiederverwenden. Versioniert nach
+# torch/CUDA, da Kernel zwischen Versionen nicht kompatibel sind.
+_CACHE_DIR = Path(os.getenv("COMPILE_CACHE_DIR", "/models/denoiser/.cache")) / (
+    f"torch-{torch.__version__}-cuda-{torch.version.cuda or 'none'}"
+)
+os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", str(_CACHE_DIR / "inductor"))
+os.environ.setdefault("TRITON_CACHE_DIR", str(_CACHE_DIR / "triton"))
+os.environ.setdefault("CUDA_CACHE_PATH", str(_CACHE_DIR / "nv_compute"))
 
 # Globale Referenzen (lazy loaded)
 _denoiser = None
 _enhancer = None
 
+# Dateiendungen, die zugleich Decoder-Formatnamen sind. Andere Container
+# (.opus, .m4a, .webm, …) erkennt der Decoder selbst am Stream.
+_FORMAT_HINTS = {".wav": "wav", ".mp3": "mp3", ".flac": "flac", ".ogg": "ogg"}
+
+# Warmup-Eingabe: 1 s Stille bei 44.1 kHz
+WARMUP_SAMPLE_RATE = 44100
+
+# Gleichzeitige GPU-Inferenzen (Rest wartet, Event-Loop bleibt frei)
+_gpu_sema = asyncio.Semaphore(int(os.getenv("GPU_CONCURRENCY", "1")))
+
+# Pinned-Staging-Puffer für H2D-Kopien (5 min @ 48 kHz, wächst bei Bedarf)
+PINNED_SAMPLES = 5 * 60 * 48000
+_pinned_audio: torch.Tensor | None = None
+_pinned_ready: torch.cuda.Event | None = None
+_pinned_lock = threading.Lock()
+
 
 def _load_models():
     """Lazy-Load Resemble Enhance Modelle."""
@@ -44,9 +88,12 @@ def _load_models():
 
     logger.info("Lade Resemble Enhance Modelle...")
     try:
-        from resemble_enhance.enhancer.inference import denoise, enhance
+        from resemble_enhance.enhancer.inference import denoise, enhance, load_enhancer
+
+        if COMPILE and DEVICE == "cuda":
+            # load_enhancer ist gecacht → denoise/enhance nutzen dieselbe Instanz
+            _compile_enhancer(load_enhancer(None, DEVICE))
 
-        # Warmup — lädt die Modelle implizit
         _denoiser = denoise
         _enhancer = enhance
         logger.info(f"Resemble Enhance geladen auf {DEVICE}")
@@ -60,6 +107,59 @@ def _load_models():
         _enhancer = None
 
 
+def _compile_enhancer(enhancer: torch.nn.Module):
+    """
+    Kompiliert die Teilnetze (Denoiser, CFM, Vocoder) mit torch.compile.
+    dynamic=True, damit unterschiedliche Audiolängen nicht jeweils neu
+    kompilieren. Die eigentliche Kompilierung passiert beim Warmup; schlägt
+    sie fehl, setzt _uncompile_enhancer die Teilnetze auf Eager zurück.
+    """
+    for name in ("denoiser", "lcfm", "vocoder"):
+        module = getattr(enhancer, name, None)
+        if isinstance(module, torch.nn.Module):
+            module.compile(dynamic=True)
+            logger.info(f"torch.compile aktiviert: {name}")
+
+
+def _uncompile_enhancer(enhancer: torch.nn.Module):
+    """Macht nn.Module.compile rückgängig (Aufrufe wieder eager)."""
+    for name in ("denoiser", "lcfm", "vocoder"):
+        module = getattr(enhancer, name, None)
+        if isinstance(module, torch.nn.Module):
+            module._compiled_call_impl = None
+            logger.info(f"torch.compile deaktiviert: {name}")
+
+
+def _to_device(audio: torch.Tensor) -> torch.Tensor:
+    """
+    Kopiert Audio über einen wiederverwendeten Pinned-Memory-Puffer
+    asynchron auf die GPU (statt blockierender Kopie aus pageable Memory).
+    """
+    global _pinned_audio, _pinned_ready
+
+    if DEVICE != "cuda":
+        return audio
+
+    audio = audio.contiguous()
+    n = audio.numel()
+    with _pinned_lock:
+        if _pinned_audio is None or n > _pinned_audio.numel():
+            _pinned_audio = torch.empty(
+                max(n, PINNED_SAMPLES), dtype=torch.float32, pin_memory=True
+            )
+        elif _pinned_ready is not None:
+            # Vorherige Kopie muss den Puffer verlassen haben
+            _pinned_ready.synchronize()
+
+        staging = _pinned_audio[:n]
+        staging.copy_(audio.view(-1))
+        gpu_audio = staging.view_as(audio).to(DEVICE, non_blocking=True)
+        _pinned_ready = torch.cuda.Event()
+        _pinned_ready.record()
+
+    return gpu_audio
+
+
 def _fallback_denoise(audio: torch.Tensor, sr: int, device: str) -> tuple:
     """
     Einfaches Spectral-Gating Denoising als Fallback
@@ -75,16 +175,15 @@ def _fallback_denoise(audio: torch.Tensor, sr: int, device: str) -> tuple:
 
     # Unter Threshold = Noise → dämpfen
     mask = (torch.abs(audio) > threshold).float()
-    # Smoothing
+    # Smoothing (gleitender Mittelwert als Box-Filter, ohne Kernel-Tensor)
     kernel_size = 1024
-    if mask.shape[-1] > kernel_size:
-        kernel = torch.ones(1, 1, kernel_size, device=mask.device) / kernel_size
-        if mask.dim() == 2:
-            mask = mask.unsqueeze(0)
-        mask = torch.nn.functional.conv1d(
-            mask, kernel, padding=kernel_size // 2
+    num_samples = mask.shape[-1]
+    if num_samples > kernel_size:
+        mask = torch.nn.functional.avg_pool1d(
+            mask, kernel_size=kernel_size, stride=1, padding=kernel_size // 2
         )
-        mask = mask.squeeze(0)
+        # Gerade Kernelgröße → ein Sample zu viel
+        mask = mask[..., :num_samples]
 
     mask = torch.clamp(mask, 0, 1)
     denoised = audio * mask
@@ -92,15 +191,117 @@ def _fallback_denoise(audio: torch.Tensor, sr: int, device: str) -> tuple:
     return denoised.squeeze(0), sr
 
 
+def _warmup():
+    """
+    Lädt die Modelle und schickt einmal Stille durch Denoise + Enhance,
+    damit CUDA-Kontext, cuDNN-Algorithmen und Allocator vor der ersten
+    echten Anfrage initialisiert sind.
+    """
+    _load_models()
+    try:
+        _warmup_pass()
+    except Exception as e:
+        if not (COMPILE and DEVICE == "cuda" and _enhancer is not None):
+            raise
+        # Compiler-Fehler träfe sonst jeden späteren Request → Eager
+        logger.warning(f"Warmup mit torch.compile fehlgeschlagen, nutze Eager: {e}")
+        from resemble_enhance.enhancer.inference import load_enhancer
+
+        _uncompile_enhancer(load_enhancer(None, DEVICE))
+        _warmup_pass()
+
+
+def _warmup_pass():
+    """Ein Durchlauf Stille durch Denoise (+ Enhance)."""
+    silence = torch.zeros(WARMUP_SAMPLE_RATE)
+    with torch.inference_mode(), torch.autocast(
+        "cuda", dtype=torch.float16, enabled=AUTOCAST
+    ):
+        denoised, sr = _denoiser(silence, WARMUP_SAMPLE_RATE, DEVICE)
+        if _enhancer is not None:
+            _enhancer(denoised, sr, DEVICE, nfe=32)
+
+
+@asynccontextmanager
+async def lifespan(application: FastAPI):
+    """Modelle beim Start laden und aufwärmen."""
+    try:
+        logger.info("Warmup Denoiser...")
+        await asyncio.to_thread(_warmup)
+        logger.info("Warmup abgeschlossen.")
+    except Exception as e:
+        # Kein Abbruch: Modelle werden sonst beim ersten Request geladen
+        logger.warning(f"Warmup fehlgeschlagen: {e}")
+    yield
+
+
+app = FastAPI(title="Denoiser Service", version="1.0.0", lifespan=lifespan)
+
+
 @app.get("/health")
 async def health():
     return {"status": "ok", "service": "denoiser"}
 
 
+def _process_audio(
+    source: BinaryIO, filename: str, do_enhance: bool
+) -> tuple[np.ndarray, int]:
+    """Dekodieren → Denoise (+ Enhance) → Peak-Normalisierung (blockierend)."""
+    _load_models()
+
+    # Direkt aus dem Upload-Spool dekodieren (keine Kopie der Bytes)
+    audio, sr = torchaudio.load(
+        source,
+        format=_FORMAT_HINTS.get(Path(filename).suffix.lower()),
+    )
+
+    # Erst auf die GPU, dann dort zu Mono mischen (kein CPU-Durchlauf)
+    audio = _to_device(audio)
+    if audio.shape[0] > 1:
+        audio = audio.mean(dim=0, keepdim=False)
+    else:
+        audio = audio.squeeze(0)
+
+    # Inferenz ohne Autograd-Buchführung, FP16-Autocast auf der GPU
+    with torch.inference_mode(), torch.autocast(
+        "cuda", dtype=torch.float16, enabled=AUTOCAST
+    ):
+        # Denoising
+        if _denoiser is not None:
+            logger.info("Starte Denoising...")
+            denoised, new_sr = _denoiser(audio, sr, DEVICE)
+            logger.info("Denoising abgeschlossen.")
+        else:
+            denoised, new_sr = audio, sr
+
+        # Optional: Enhancement (Bandbreiten-Erweiterung)
+        if do_enhance and _enhancer is not None:
+            logger.info("Starte Enhancement...")
+            enhanced, new_sr = _enhancer(
+                denoised, new_sr, DEVICE,
+                nfe=32,  # Number of function evaluations für CFM
+            )
+            output_audio = enhanced
+            output_sr = new_sr
+            logger.info("Enhancement abgeschlossen.")
+        else:
+            output_audio = denoised
+            output_sr = new_sr
+
+    # Peak-Normalisierung auf dem Device des Ergebnisses (FP16 aus
+    # Autocast → float32), danach eine einzige Kopie nach numpy.
+    output_audio = torch.as_tensor(output_audio).float()
+    peak = output_audio.abs().amax()
+    # Nicht in-place: Ergebnis ist ein Inference-Tensor
+    output_audio = output_audio * (0.95 / peak.clamp(min=1e-9))
+    return output_audio.cpu().numpy(), output_sr
+
+
 @app.post("/denoise")
 async def denoise_audio(
     file: UploadFile = File(...),
     enhance: str = Form("true"),
+    subtype: str = Form("PCM_16"),
 ):
     """
     Bereinigt Audio-Dateien.
@@ -108,92 +309,50 @@ async def denoise_audio(
     Args:
         file: Audio-Datei (WAV, MP3, FLAC, OGG)
         enhance: "true" für Denoise + Enhance, "false" nur Denoise
+        subtype: WAV-Sampleformat, Standard PCM_16 (halbe Größe ggü. FLOAT)
     
     Returns:
         Bereinigte Audio-Datei (WAV, 44.1kHz)
     """
-    audio_bytes = await file.read()
-    if not audio_bytes:
+    if not sf.check_format("WAV", subtype):
+        raise HTTPException(status_code=400, detail=f"Ungültiges WAV-Format: {subtype}")
+
+    if not file.size:
         raise HTTPException(status_code=400, detail="Leere Datei.")
 
     do_enhance = enhance.lower() == "true"
 
     logger.info(
-        f"Denoising: {file.filename}, {len(audio_bytes) / 1024 / 1024:.1f} MB, "
+        f"Denoising: {file.filename}, {file.size / 1024 / 1024:.1f} MB, "
         f"Enhance: {do_enhance}"
     )
 
     try:
-        _load_models()
-
-        # Audio in temporäre Datei schreiben und laden
-        with tempfile.NamedTemporaryFile(
-            suffix=Path(file.filename).suffix or ".wav", delete=False
-        ) as tmp:
-            tmp.write(audio_bytes)
-            tmp_path = tmp.name
-
-        try:
-            # Audio laden
-            audio, sr = torchaudio.load(tmp_path)
-
-            # Mono konvertieren
-            if audio.shape[0] > 1:
-                audio = audio.mean(dim=0, keepdim=False)
-            else:
-                audio = audio.squeeze(0)
-
-            # Denoising
-            if _denoiser is not None:
-                logger.info("Starte Denoising...")
-                denoised, new_sr = _denoiser(audio, sr, DEVICE)
-                logger.info("Denoising abgeschlossen.")
-            else:
-                denoised, new_sr = audio, sr
-
-            # Optional: Enhancement (Bandbreiten-Erweiterung)
-            if do_enhance and _enhancer is not None:
-                logger.info("Starte Enhancement...")
-                enhanced, new_sr = _enhancer(
-                    denoised, new_sr, DEVICE,
-                    nfe=32,  # Number of function evaluations für CFM
-                )
-                output_audio = enhanced
-                output_sr = new_sr
-                logger.info("Enhancement abgeschlossen.")
-            else:
-                output_audio = denoised
-                output_sr = new_sr
-
-            # Zu numpy konvertieren
-            if isinstance(output_audio, torch.Tensor):
-                output_audio = output_audio.cpu().numpy()
-
-            # Normalisieren (-1 bis 1)
-            max_val = np.abs(output_audio).max()
-            if max_val > 0:
-                output_audio = output_audio / max_val * 0.95
-
-            # Als WAV in Buffer schreiben
-            buffer = io.BytesIO()
-            sf.write(buffer, output_audio, output_sr, format="WAV")
-            buffer.seek(0)
-
-            logger.info(
-                f"Denoising abgeschlossen: {file.filename} → "
-                f"{output_sr}Hz, {len(output_audio) / output_sr:.1f}s"
+        # GPU-Arbeit im Thread, begrenzt auf GPU_CONCURRENCY gleichzeitige Läufe
+        async with _gpu_sema:
+            output_audio, output_sr = await asyncio.to_thread(
+                _process_audio, file.file, file.filename, do_enhance
             )
 
-            return StreamingResponse(
-                buffer,
-                media_type="audio/wav",
-                headers={
-                    "Content-Disposition": f"attachment; filename=denoised_{file.filename}"
-                },
-            )
+        # Als WAV in Buffer schreiben (CPU, außerhalb des GPU-Slots)
+        buffer = io.BytesIO()
+        await asyncio.to_thread(
+            sf.write, buffer, output_audio, output_sr, format="WAV", subtype=subtype
+        )
+        buffer.seek(0)
 
-        finally:
-            os.unlink(tmp_path)
+        logger.info(
+            f"Denoising abgeschlossen: {file.filename} → "
+            f"{output_sr}Hz, {len(output_audio) / output_sr:.1f}s"
+        )
+
+        return StreamingResponse(
+            buffer,
+            media_type="audio/wav",
+            headers={
+                "Content-Disposition": f"attachment; filename=denoised_{file.filename}"
+            },
+        )
 
     except HTTPException:
         raise
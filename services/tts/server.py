@@ -12,26 +12,76 @@ Endpunkte:
   GET  /health           — Health-Check
 """
 
+import asyncio
 import io
 import os
-import tempfile
+import re
+import shutil
+import struct
+from contextlib import asynccontextmanager
+from functools import cache
+from operator import attrgetter
 from pathlib import Path
 
 import numpy as np
 import soundfile as sf
+import torch
 from fastapi import FastAPI, File, Form, UploadFile, HTTPException
 from fastapi.responses import StreamingResponse
 from loguru import logger
 from pydantic import BaseModel
 from typing import Optional
 
-app = FastAPI(title="TTS Service", version="1.0.0")
-
 # Globale Referenz
 _tts_model = None
 _reference_dir = Path("/models/tts/reference")
+_REFERENCE_EXTS = (".wav", ".mp3", ".flac", ".ogg")
+
+# Stimmen-Index: Name → Pfad, neu aufgebaut wenn sich das Verzeichnis ändert
+_voice_index: dict[str, str] = {}
+_voice_index_mtime: Optional[float] = None
+
+# Gleichzeitige GPU-Inferenzen (Rest wartet, Event-Loop bleibt frei)
+_gpu_sema = asyncio.Semaphore(int(os.getenv("GPU_CONCURRENCY", "1")))
+
+# Laufende Synthesen: (Text, Sprache, Referenz) → Task. Identische
+# gleichzeitige Anfragen warten auf dieselbe Synthese.
+_inflight: dict[tuple, asyncio.Task] = {}
+
+# Satzgrenzen für /synthesize-stream
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+")
+
+# Speaker-Latents je Referenz-Audio: Pfad → (mtime, (gpt_cond_latent, speaker_embedding))
+_latent_cache: dict[str, tuple[float, tuple]] = {}
 
 DEVICE = os.getenv("TTS_DEVICE", "cuda")
+COMPILE = os.getenv("TTS_COMPILE", "true").lower() == "true"
+AUTOCAST = DEVICE == "cuda" and os.getenv("TTS_AUTOCAST", "true").lower() == "true"
+
+# cuDNN-Autotuning + TF32: Algorithmus-Suche je Input-Shape einmalig (beim
+# Warmup), danach schnellere Kernel; TF32-Matmuls auf Ampere+ bei
+# vernachlässigbarem Genauigkeitsverlust
+torch.backends.cudnn.benchmark = True
+torch.backends.cudnn.allow_tf32 = True
+torch.backends.cuda.matmul.allow_tf32 = True
+torch.set_float32_matmul_precision("high")
+
+# TorchScript: Profiling-Executor aus. Dieser rekompiliert den Graphen beim
+# zweiten Aufruf mit Profil-Infos → Latenzspitze beim ersten echten Request
+# nach dem Warmup. Ohne Profiling nur statische Graph-Optimierung, dafür
+# gleichmäßige Latenz je Request.
+torch._C._jit_set_profiling_executor(False)
+torch._C._jit_set_profiling_mode(False)
+
+# Kompilier-Caches (Inductor, Triton, CUDA-JIT) im Modell-Volume, damit
+# Neustarts bereits kompilierte Kernel wiederverwenden. Versioniert nach
+# torch/CUDA, da Kernel zwischen Versionen nicht kompatibel sind.
+_CACHE_DIR = Path(os.getenv("COMPILE_CACHE_DIR", "/models/tts/.cache")) / (
+    f"torch-{torch.__version__}-cuda-{torch.version.cuda or 'none'}"
+)
+os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", str(_CACHE_DIR / "inductor"))
+os.environ.setdefault("TRITON_CACHE_DIR", str(_CACHE_DIR / "triton"))
+os.environ.setdefault("CUDA_CACHE_PATH", str(_CACHE_DIR / "nv_compute"))
 
 
 class SynthesizeRequest(BaseModel):
@@ -54,29 +104,237 @@ def _get_model():
             )
             _tts_model = TTS(model_name, gpu=(DEVICE == "cuda"))
             logger.info(f"XTTS-v2 geladen auf {DEVICE}")
+            if COMPILE and DEVICE == "cuda":
+                _compile_xtts(_tts_model.synthesizer.tts_model)
         except Exception as e:
             logger.error(f"TTS-Modell Laden fehlgeschlagen: {e}")
             raise RuntimeError(f"TTS nicht verfügbar: {e}")
     return _tts_model
 
 
-def _get_reference_audio(voice: str = "default") -> Optional[str]:
-    """Findet Referenz-Audio für Voice-Cloning."""
+def _refresh_voice_index():
+    """
+    Scannt das Referenz-Verzeichnis einmal und baut den Stimmen-Index.
+    Gibt es eine Stimme in mehreren Formaten, gilt die Reihenfolge in
+    _REFERENCE_EXTS.
+    """
+    global _voice_index, _voice_index_mtime
     _reference_dir.mkdir(parents=True, exist_ok=True)
+    mtime = _reference_dir.stat().st_mtime
+
+    files = [f for f in _reference_dir.iterdir() if f.suffix in _REFERENCE_EXTS]
+    files.sort(key=lambda f: _REFERENCE_EXTS.index(f.suffix), reverse=True)
+    _voice_index = {f.stem: str(f) for f in files}
+    _voice_index_mtime = mtime
+
+
+def _compiled_modules(xtts: torch.nn.Module) -> dict[str, torch.nn.Module]:
+    """Module, die torch.compile erhalten: GPT-Decoder und HiFi-GAN."""
+    modules = {}
+    for name in ("gpt.gpt_inference", "hifigan_decoder"):
+        try:
+            module = attrgetter(name)(xtts)
+        except AttributeError:
+            continue
+        if isinstance(module, torch.nn.Module):
+            modules[name] = module
+    return modules
+
+
+def _compile_xtts(xtts: torch.nn.Module):
+    """
+    Kompiliert GPT-Decoder und HiFi-GAN mit torch.compile (in place, damit
+    XTTS' eigene Aufrufe die kompilierten Module nutzen). dynamic=True, da
+    Token- und Latent-Längen je Satz variieren. Kompiliert wird beim Warmup;
+    schlägt der fehl, setzt _uncompile_xtts die Module auf Eager zurück.
+    """
+    for name, module in _compiled_modules(xtts).items():
+        module.compile(dynamic=True)
+        logger.info(f"torch.compile aktiviert: {name}")
+
+
+def _uncompile_xtts(xtts: torch.nn.Module):
+    """Macht nn.Module.compile rückgängig (Aufrufe wieder eager)."""
+    for name, module in _compiled_modules(xtts).items():
+        module._compiled_call_impl = None
+        logger.info(f"torch.compile deaktiviert: {name}")
+
+
+def _get_reference_audio(voice: str = "default") -> Optional[str]:
+    """
+    Findet Referenz-Audio für Voice-Cloning (Fallback: Default-Referenz).
+    Pro Aufruf nur ein stat auf das Verzeichnis; der Index wird nur neu
+    aufgebaut, wenn dort Dateien hinzugekommen oder entfernt wurden.
+    """
+    try:
+        mtime = _reference_dir.stat().st_mtime
+    except FileNotFoundError:
+        mtime = None
+    if mtime is None or mtime != _voice_index_mtime:
+        _refresh_voice_index()
+
+    return _voice_index.get(voice) or _voice_index.get("default")
+
+
+def _get_conditioning_latents(reference_audio: str) -> tuple:
+    """
+    Liefert (gpt_cond_latent, speaker_embedding) für ein Referenz-Audio.
+    Einmal je Datei berechnet; bei geänderter Datei (mtime) neu.
+    """
+    mtime = os.path.getmtime(reference_audio)
+    cached = _latent_cache.get(reference_audio)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    xtts = _get_model().synthesizer.tts_model
+    # Dieselben Config-Werte wie Xtts.synthesize (tts_to_file), sonst
+    # greifen die kürzeren Bibliotheks-Defaults (z.B. 6 s statt 30 s Referenz)
+    config = xtts.config
+    latents = xtts.get_conditioning_latents(
+        audio_path=[reference_audio],
+        gpt_cond_len=config.gpt_cond_len,
+        gpt_cond_chunk_len=config.gpt_cond_chunk_len,
+        max_ref_length=config.max_ref_len,
+        sound_norm_refs=config.sound_norm_refs,
+    )
+    _latent_cache[reference_audio] = (mtime, latents)
+    logger.info(f"Speaker-Latents berechnet: {reference_audio}")
+    return latents
+
+
+def _synthesize_waveform(
+    text: str, language: str, reference_audio: Optional[str]
+) -> np.ndarray:
+    """Synthetisiert Text zu einer float32-Waveform (Sample-Rate des Modells)."""
+    model = _get_model()
+
+    if reference_audio:
+        # Voice-Cloning mit gecachten Speaker-Latents (kein erneutes Encoding)
+        gpt_cond_latent, speaker_embedding = _get_conditioning_latents(reference_audio)
+        xtts = model.synthesizer.tts_model
+        config = xtts.config
+        with torch.inference_mode(), torch.autocast(
+            "cuda", dtype=torch.float16, enabled=AUTOCAST
+        ):
+            # Sampling-Parameter aus der Modell-Config wie in Xtts.synthesize
+            out = xtts.inference(
+                text,
+                language,
+                gpt_cond_latent,
+                speaker_embedding,
+                temperature=config.temperature,
+                length_penalty=config.length_penalty,
+                repetition_penalty=config.repetition_penalty,
+                top_k=config.top_k,
+                top_p=config.top_p,
+                enable_text_splitting=True,
+            )
+        wav = out["wav"]
+        if hasattr(wav, "cpu"):
+            wav = wav.float().cpu().numpy()
+    else:
+        # Standard-Stimme (erste verfügbare)
+        with torch.inference_mode(), torch.autocast(
+            "cuda", dtype=torch.float16, enabled=AUTOCAST
+        ):
+            wav = model.tts(text=text, language=language)
+
+    return np.asarray(wav, dtype=np.float32)
+
+
+async def _run_synthesis(
+    text: str, language: str, reference_audio: Optional[str]
+) -> np.ndarray:
+    """GPU-Inferenz im Thread, begrenzt auf GPU_CONCURRENCY gleichzeitige Läufe."""
+    async with _gpu_sema:
+        return await asyncio.to_thread(
+            _synthesize_waveform, text, language, reference_audio
+        )
+
+
+async def _synthesize(
+    text: str, language: str, reference_audio: Optional[str]
+) -> np.ndarray:
+    """
+    Synthetisiert Text; läuft dieselbe Anfrage bereits, wird deren Ergebnis
+    mitgenutzt. shield: Bricht ein Client ab, laufen die anderen weiter.
+    """
+    key = (text, language, reference_audio)
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(_run_synthesis(*key))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    return await asyncio.shield(task)
+
+
+@cache
+def _wav_stream_header(sample_rate: int) -> bytes:
+    """
+    WAV-Header für PCM16 mono mit unbekannter Länge (Streaming):
+    RIFF- und data-Größe auf Maximalwert, wie bei Live-Streams üblich.
+    """
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 0xFFFFFFFF, b"WAVE",
+        b"fmt ", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16,
+        b"data", 0xFFFFFFFF,
+    )
+
+
+def _to_pcm16(wav: np.ndarray) -> np.ndarray:
+    """
+    float32-Waveform [-1, 1] → PCM16 (little-endian). Clipping erfolgt in
+    place, die Skalierung schreibt direkt in einen vorab allokierten
+    int16-Puffer – keine zusätzliche float-Kopie der Waveform.
+    """
+    np.clip(wav, -1.0, 1.0, out=wav)
+    pcm = np.empty(wav.shape, dtype="<i2")
+    np.multiply(wav, 32767, out=pcm, casting="unsafe")
+    return pcm
+
+
+def _warmup():
+    """
+    Lädt XTTS-v2 und synthetisiert einen kurzen Satz, damit CUDA-Kontext,
+    Kernel und Allocator vor der ersten echten Anfrage initialisiert sind.
+    """
+    global AUTOCAST
+    _get_model()
+    # Berechnet dabei auch die Latents der Default-Stimme
+    wav = _synthesize_waveform("Test.", "de", _get_reference_audio())
 
-    # Suche nach benannter Stimme
-    for ext in [".wav", ".mp3", ".flac", ".ogg"]:
-        path = _reference_dir / f"{voice}{ext}"
-        if path.exists():
-            return str(path)
+    # FP16-Plausibilitätsprüfung: NaN/Inf oder Stille → zurück auf FP32
+    if AUTOCAST and (not np.isfinite(wav).all() or not np.abs(wav).max() > 0):
+        logger.warning("FP16-Autocast liefert ungültiges Audio, deaktiviert.")
+        AUTOCAST = False
+
+
+@asynccontextmanager
+async def lifespan(application: FastAPI):
+    """Modell beim Start laden und aufwärmen."""
+    global AUTOCAST
+    try:
+        logger.info("Warmup XTTS-v2...")
+        await asyncio.to_thread(_warmup)
+        logger.info("Warmup abgeschlossen.")
+    except Exception as e:
+        # Kompilierung und FP16 sind ungeprüft (oder gerade gescheitert) →
+        # Eager + FP32, sonst scheitert jeder Request am selben Compiler-Fehler
+        logger.warning(f"Warmup fehlgeschlagen, Fallback auf Eager + FP32: {e}")
+        AUTOCAST = False
+        if _tts_model is not None:
+            _uncompile_xtts(_tts_model.synthesizer.tts_model)
+        try:
+            await asyncio.to_thread(_warmup)
+            logger.info("Warmup (Eager) abgeschlossen.")
+        except Exception as e:
+            # Kein Abbruch: Modell wird sonst beim ersten Request geladen
+            logger.warning(f"Warmup (Eager) fehlgeschlagen: {e}")
+    yield
 
-    # Fallback: Default-Referenz
-    for ext in [".wav", ".mp3", ".flac", ".ogg"]:
-        path = _reference_dir / f"default{ext}"
-        if path.exists():
-            return str(path)
 
-    return None
+app = FastAPI(title="TTS Service", version="1.0.0", lifespan=lifespan)
 
 
 @app.get("/health")
@@ -87,11 +345,11 @@ async def health():
 @app.get("/voices")
 async def list_voices():
     """Listet alle verfügbaren Stimmen (Referenz-Audios)."""
-    _reference_dir.mkdir(parents=True, exist_ok=True)
-    voices = []
-    for f in _reference_dir.iterdir():
-        if f.suffix in [".wav", ".mp3", ".flac", ".ogg"]:
-            voices.append({"name": f.stem, "file": f.name})
+    await asyncio.to_thread(_refresh_voice_index)
+    voices = [
+        {"name": name, "file": Path(path).name}
+        for name, path in _voice_index.items()
+    ]
 
     return {"voices": voices, "default_available": any(v["name"] == "default" for v in voices)}
 
@@ -120,52 +378,36 @@ async def synthesize(request: SynthesizeRequest):
 
     try:
         model = _get_model()
-        reference_audio = _get_reference_audio(request.voice)
-
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp:
-            tmp_path = tmp.name
-
-        try:
-            if reference_audio:
-                # Voice-Cloning mit Referenz-Audio
-                model.tts_to_file(
-                    text=request.text,
-                    file_path=tmp_path,
-                    speaker_wav=reference_audio,
-                    language=request.language,
-                )
-            else:
-                # Standard-Stimme (erste verfügbare)
-                model.tts_to_file(
-                    text=request.text,
-                    file_path=tmp_path,
-                    language=request.language,
-                )
-
-            # Audio lesen und zurückgeben
-            audio_data, sample_rate = sf.read(tmp_path)
-
-            # Format konvertieren
-            buffer = io.BytesIO()
-            sf.write(buffer, audio_data, sample_rate, format="WAV")
-            buffer.seek(0)
-
-            content_type = {
-                "wav": "audio/wav",
-                "mp3": "audio/mpeg",
-            }.get(request.format, "audio/wav")
-
-            return StreamingResponse(
-                buffer,
-                media_type=content_type,
-                headers={
-                    "Content-Disposition": f"attachment; filename=speech.{request.format}"
-                },
-            )
-
-        finally:
-            if os.path.exists(tmp_path):
-                os.unlink(tmp_path)
+        # Dateisystemzugriff im Thread (Referenz-Verzeichnis ggf. auf NFS)
+        reference_audio = await asyncio.to_thread(_get_reference_audio, request.voice)
+        wav = await _synthesize(request.text, request.language, reference_audio)
+
+        # PCM16 direkt in den Antwort-Puffer schreiben (keine temporäre Datei,
+        # kein float64-Zwischenpuffer in libsndfile)
+        buffer = io.BytesIO()
+        with sf.SoundFile(
+            buffer,
+            mode="w",
+            samplerate=model.synthesizer.output_sample_rate,
+            channels=1,
+            format="WAV",
+            subtype="PCM_16",
+        ) as out:
+            out.write(_to_pcm16(wav))
+        buffer.seek(0)
+
+        content_type = {
+            "wav": "audio/wav",
+            "mp3": "audio/mpeg",
+        }.get(request.format, "audio/wav")
+
+        return StreamingResponse(
+            buffer,
+            media_type=content_type,
+            headers={
+                "Content-Disposition": f"attachment; filename=speech.{request.format}"
+            },
+        )
 
     except HTTPException:
         raise
@@ -174,6 +416,56 @@ async def synthesize(request: SynthesizeRequest):
         raise HTTPException(status_code=500, detail=f"TTS fehlgeschlagen: {e}")
 
 
+@app.post("/synthesize-stream")
+async def synthesize_stream(request: SynthesizeRequest):
+    """
+    Wie /synthesize, aber satzweise: Der WAV-Header geht sofort raus,
+    danach die PCM16-Frames jedes Satzes, sobald er synthetisiert ist.
+    Der Client kann abspielen, bevor der gesamte Text fertig ist.
+    """
+    if not request.text:
+        raise HTTPException(status_code=400, detail="Kein Text angegeben.")
+
+    if len(request.text) > 10000:
+        raise HTTPException(
+            status_code=400,
+            detail="Text zu lang (max. 10.000 Zeichen). Teile den Text auf."
+        )
+
+    sentences = [s for s in _SENTENCE_SPLIT.split(request.text.strip()) if s]
+
+    logger.info(
+        f"TTS-Stream: {len(request.text)} Zeichen, {len(sentences)} Sätze, "
+        f"Sprache: {request.language}, Stimme: {request.voice}"
+    )
+
+    try:
+        model = _get_model()
+        # Dateisystemzugriff im Thread (Referenz-Verzeichnis ggf. auf NFS)
+        reference_audio = await asyncio.to_thread(_get_reference_audio, request.voice)
+    except Exception as e:
+        logger.error(f"TTS-Stream fehlgeschlagen: {e}")
+        raise HTTPException(status_code=500, detail=f"TTS fehlgeschlagen: {e}")
+
+    async def generate():
+        yield _wav_stream_header(model.synthesizer.output_sample_rate)
+        for sentence in sentences:
+            try:
+                # GPU-Slot je Satz → parallele Streams wechseln sich ab
+                wav = await _synthesize(sentence, request.language, reference_audio)
+            except Exception as e:
+                # Header ist schon gesendet → Stream nur noch beenden
+                logger.error(f"TTS-Stream abgebrochen: {e}")
+                return
+            yield _to_pcm16(wav).tobytes()
+
+    return StreamingResponse(
+        generate(),
+        media_type="audio/wav",
+        headers={"Content-Disposition": "attachment; filename=speech.wav"},
+    )
+
+
 @app.post("/clone-voice")
 async def clone_voice(
     file: UploadFile = File(...),
@@ -183,8 +475,7 @@ async def clone_voice(
     Lädt Referenz-Audio für Voice-Cloning hoch.
     Mindestens 6 Sekunden klares Sprach-Audio empfohlen.
     """
-    audio_bytes = await file.read()
-    if not audio_bytes:
+    if not file.size:
         raise HTTPException(status_code=400, detail="Leere Datei.")
 
     _reference_dir.mkdir(parents=True, exist_ok=True)
@@ -193,14 +484,19 @@ async def clone_voice(
     ext = Path(file.filename).suffix or ".wav"
     save_path = _reference_dir / f"{name}{ext}"
 
-    with open(save_path, "wb") as f:
-        f.write(audio_bytes)
+    # Upload blockweise auf die Platte kopieren (nie komplett im RAM)
+    def _save():
+        with open(save_path, "wb") as f:
+            shutil.copyfileobj(file.file, f, 1 << 20)
+        _refresh_voice_index()
+
+    await asyncio.to_thread(_save)
 
-    logger.info(f"Referenz-Audio gespeichert: {save_path} ({len(audio_bytes)} bytes)")
+    logger.info(f"Referenz-Audio gespeichert: {save_path} ({file.size} bytes)")
 
     return {
         "status": "success",
         "voice_name": name,
         "file": str(save_path),
-        "size_bytes": len(audio_bytes),
+        "size_bytes": file.size,
     }